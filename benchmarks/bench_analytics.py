@@ -0,0 +1,67 @@
+import argparse
+import json
+import tempfile
+from collections import Counter
+import networkx as nx
+from pklx import analytics
+from pklx.parser import load, statements_to_graph
+from benchmarks.bench_pipeline import environment, time_stage
+from benchmarks.corpus import add_corpus_arguments, generate_corpus
+
+
+def networkx_pagerank(graph: nx.DiGraph) -> dict:
+    # nx.pagerank needs scipy, the pure python version is the fallback networkx itself tests against
+    try:
+        return nx.pagerank(graph)
+    except ImportError:
+        from networkx.algorithms.link_analysis.pagerank_alg import _pagerank_python
+        return _pagerank_python(graph)
+
+
+def run_benchmark(graph: nx.DiGraph, repeat: int = 3) -> dict:
+    stages = {}
+    stages['to_csr'], csr = time_stage(lambda: analytics.to_csr(graph), repeat)
+    implementations = {
+        'degrees': (lambda: analytics.degree_stats(csr), lambda: [(graph.in_degree(node), graph.out_degree(node)) for node in graph.nodes]),
+        'pagerank': (lambda: analytics.pagerank(csr), lambda: networkx_pagerank(graph)),
+        'components': (lambda: analytics.connected_components(csr), lambda: list(nx.weakly_connected_components(graph))),
+        'relations': (lambda: analytics.relation_histogram(csr), lambda: Counter(label for _, label in graph.nodes(data='label') if label is not None))
+    }
+    for name, (numpy_function, networkx_function) in implementations.items():
+        stages[name], _ = time_stage(numpy_function, repeat)
+        stages[name + '_networkx'], _ = time_stage(networkx_function, repeat)
+    return {'counts': {'nodes': csr.node_count, 'edges': csr.edge_count}, 'stages': stages}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the numpy graph analytics with their networkx equivalents on a synthetic corpus')
+    add_corpus_arguments(parser)
+    parser.add_argument('--folder', type=str, help='Use an existing data folder instead of generating a corpus')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of runs per stage, the best run counts')
+    parser.add_argument('--output', type=str, help='Write the results to a JSON file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temporary_folder:
+        if args.folder is not None:
+            folder_path = args.folder
+            corpus = {'folder': args.folder}
+        else:
+            folder_path = temporary_folder
+            corpus = generate_corpus(folder_path, args.files, args.statements, args.relations, args.depth, args.named, args.variables, args.seed)
+        graph = statements_to_graph(load(folder_path, use_cache=False)[1])
+    results = {'environment': environment(), 'corpus': corpus, 'repeat': args.repeat}
+    results.update(run_benchmark(graph, args.repeat))
+
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=4)
+    stages = results['stages']
+    print(f'{"stage":>12} {"numpy":>12} {"networkx":>12} {"speedup":>8}')
+    for name, result in stages.items():
+        if name.endswith('_networkx'):
+            continue
+        if name + '_networkx' in stages:
+            before = stages[name + '_networkx']['seconds']
+            print(f'{name:>12} {result["seconds"] * 1000:10.1f}ms {before * 1000:10.1f}ms {before / result["seconds"]:7.0f}x')
+        else:
+            print(f'{name:>12} {result["seconds"] * 1000:10.1f}ms')
@@ -0,0 +1,102 @@
+import argparse
+import configparser
+import json
+import os
+import subprocess
+import sys
+import time
+from typing import Dict, List, Tuple
+from benchmarks.bench_pipeline import compare, environment
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+# packages that should only be imported by the commands that need them
+HEAVY_PACKAGES = ['flask', 'werkzeug', 'jinja2', 'networkx', 'numpy']
+
+
+def console_scripts() -> Dict[str, str]:
+    config = configparser.ConfigParser()
+    config.read(os.path.join(ROOT, 'setup.cfg'))
+    scripts = {}
+    for line in config['options.entry_points']['console_scripts'].splitlines():
+        if '=' in line:
+            script, entry_point = line.split('=')
+            scripts[script.strip()] = entry_point.strip()
+    return scripts
+
+
+def modules() -> List[str]:
+    package = os.path.join(ROOT, 'src', 'pklx')
+    names = []
+    for folder, _, files in os.walk(package):
+        for file in sorted(files):
+            if file.endswith('.py') and file != '__init__.py':
+                relative = os.path.relpath(os.path.join(folder, file[:-3]), os.path.dirname(package))
+                names.append(relative.replace(os.sep, '.'))
+    return names
+
+
+def script_code(script: str, entry_point: str) -> str:
+    # everything a console script imports before it starts working, i.e. until its arguments are parsed
+    module, function = entry_point.split(':')
+    return f'import sys\nsys.argv = [{script!r}, "--help"]\nfrom {module} import {function}\ntry:\n    {function}()\nexcept SystemExit:\n    pass'
+
+
+def import_time(code: str) -> Tuple[float, float, List[str]]:
+    # returns the wall time of the process, the time spent importing and the imported modules
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    if process.returncode != 0:
+        raise Exception(f'Could not run {code!r}: {process.stderr}')
+    seconds = 0.0
+    imported = []
+    for line in process.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, _, name = line[len('import time:'):].split('|')
+        seconds += int(own) / 1e6
+        imported.append(name.strip())
+    return wall, seconds, imported
+
+
+def measure(code: str, repeat: int) -> dict:
+    runs = [import_time(code) for _ in range(repeat)]
+    imported = runs[-1][2]
+    return {
+        'seconds': min(seconds for _, seconds, _ in runs),
+        'wall': min(wall for wall, _, _ in runs),
+        'runs': [seconds for _, seconds, _ in runs],
+        'modules': len(imported),
+        'packages': [package for package in HEAVY_PACKAGES if package in imported]
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure the import time of every console script and module of pklx')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of runs per measurement, the best run counts')
+    parser.add_argument('--output', type=str, help='Write the results to a JSON file')
+    parser.add_argument('--baseline', type=str, help='Compare the results with a JSON file written by --output')
+    parser.add_argument('--threshold', type=float, default=1.5, help='Slowdown factor above which an import counts as regression')
+    args = parser.parse_args()
+
+    stages = {'python': measure('pass', args.repeat)}
+    for script, entry_point in console_scripts().items():
+        stages[script] = measure(script_code(script, entry_point), args.repeat)
+    for module in modules():
+        stages[module] = measure(f'import {module}', args.repeat)
+    results = {'environment': environment(), 'repeat': args.repeat, 'stages': stages}
+
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=4)
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as file:
+            baseline = json.load(file)
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+    else:
+        print(f'{"import":>24} {"imports":>10} {"process":>10} {"modules":>8}  packages')
+        for name, result in stages.items():
+            print(f'{name:>24} {result["seconds"] * 1000:8.1f}ms {result["wall"] * 1000:8.1f}ms {result["modules"]:>8}  {" ".join(result["packages"])}')
@@ -0,0 +1,54 @@
+import argparse
+import gc
+import json
+import pickle
+import tempfile
+import tracemalloc
+from pklx.parser import load
+from benchmarks.bench_pipeline import environment
+from benchmarks.corpus import add_corpus_arguments, generate_corpus
+
+
+def measure_memory(folder_path: str) -> dict:
+    # memory kept by the parsed statements of the data folder, the size of their pickle (as in the parse cache and the
+    # snapshot) and the memory of the statements read back from it
+    load(folder_path, use_cache=False)
+    gc.collect()
+    tracemalloc.start()
+    _, statements = load(folder_path, use_cache=False)
+    gc.collect()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    data = pickle.dumps(statements, protocol=pickle.HIGHEST_PROTOCOL)
+    del statements
+    gc.collect()
+    tracemalloc.start()
+    statements = pickle.loads(data)
+    unpickled = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return {'statements': len(statements), 'retained': retained, 'peak': peak, 'pickle': len(data), 'unpickled': unpickled}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure the memory of the parsed statements of a synthetic corpus')
+    add_corpus_arguments(parser)
+    parser.add_argument('--folder', type=str, help='Use an existing data folder instead of generating a corpus')
+    parser.add_argument('--output', type=str, help='Write the results to a JSON file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temporary_folder:
+        if args.folder is not None:
+            folder_path = args.folder
+            corpus = {'folder': args.folder}
+        else:
+            folder_path = temporary_folder
+            corpus = generate_corpus(folder_path, args.files, args.statements, args.relations, args.depth, args.named, args.variables, args.seed)
+        results = {'environment': environment(), 'corpus': corpus, 'memory': measure_memory(folder_path)}
+
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=4)
+    memory = results['memory']
+    print(f'{memory["statements"]} statements')
+    for key in ('retained', 'peak', 'pickle', 'unpickled'):
+        print(f'{key:>12} {memory[key] / 2 ** 20:8.1f} MB')
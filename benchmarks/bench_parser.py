@@ -0,0 +1,64 @@
+import argparse
+import time
+from typing import List
+from pklx.objects import PKLX, ParsingException
+from pklx.parser import compile_relations, lexer
+
+
+RELATIONS = ['IS PART OF', 'HAS PROPERTY']
+
+
+def left_nested(depth: int) -> str:
+    # ( ( ( A0 IS PART OF A1 ) HAS PROPERTY A2 ) ... )
+    statement = 'A0'
+    for i in range(1, depth + 1):
+        statement = f'( {statement} {RELATIONS[i % 2]} A{i} )'
+    return statement + f' IS PART OF A{depth + 1}'
+
+
+def right_nested(depth: int) -> str:
+    # A0 IS PART OF ( A1 HAS PROPERTY ( A2 ... ) )
+    statement = f'A{depth} IS PART OF A{depth + 1}'
+    for i in range(depth - 1, -1, -1):
+        statement = f'A{i} {RELATIONS[i % 2]} ( {statement} )'
+    return statement
+
+
+def invalid(depth: int) -> str:
+    # right nested, but the innermost statement lacks its right expression
+    return right_nested(depth).replace(f'A{depth} IS PART OF A{depth + 1}', f'A{depth} IS PART OF')
+
+
+def balanced(depth: int) -> str:
+    # ( ... ) IS PART OF ( ... ) on every level
+    if depth == 0:
+        return 'A IS PART OF B'
+    inner = balanced(depth - 1)
+    return f'( {inner} ) {RELATIONS[depth % 2]} ( {inner} )'
+
+
+def time_parse(tokens: List[str], relations, repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        try:
+            PKLX().parse(tokens, relations)
+        except ParsingException:
+            pass
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark PKLX().parse on deeply nested statements')
+    parser.add_argument('--depths', type=int, nargs='+', default=[10, 50, 100, 200])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    relations = compile_relations(RELATIONS)
+    cases = [('left', left_nested, args.depths), ('right', right_nested, args.depths), ('invalid', invalid, args.depths), ('balanced', balanced, [2, 4, 6, 8])]
+    for name, build, depths in cases:
+        for depth in depths:
+            tokens = lexer(relations, build(depth))
+            seconds = time_parse(tokens, relations, args.repeat)
+            print(f'{name:>8} depth {depth:>4} tokens {len(tokens):>5}: {seconds * 1000:10.3f} ms')
@@ -0,0 +1,140 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from importlib.metadata import PackageNotFoundError, version
+from typing import Callable, List
+from pklx.objects import PKLX
+from pklx.parser import compile_relations, extract_from_statements, lexer, list_files, load, parse_relations, split_statements, statements_to_graph
+from pklx.index import VariableIndex
+from pklx.settings import SETTINGS
+from benchmarks.corpus import add_corpus_arguments, generate_corpus
+
+
+def time_stage(function: Callable, repeat: int) -> dict:
+    # the best run is the most stable measure, all runs are kept for reference
+    runs = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        runs.append(time.perf_counter() - start)
+    return {'seconds': min(runs), 'runs': runs}, result
+
+
+def read_statements(folder_path: str) -> List[str]:
+    statements = []
+    for file_name in list_files(folder_path):
+        if os.path.split(file_name)[-1] == '.ontology':
+            continue
+        with open(file_name, 'r') as file:
+            statements.extend(split_statements(file_name, file.readlines(), SETTINGS['DELIMITER'])[0])
+    return statements
+
+
+def read_relations(folder_path: str) -> List[str]:
+    with open(os.path.join(folder_path, '.ontology'), 'r') as file:
+        return parse_relations(file.readlines())
+
+
+def related_requests(graph, variables: List[str]) -> Callable:
+    from pklx.visx import backend
+    backend.set_graph(graph)
+    client = backend.app.test_client()
+
+    def run():
+        for variable in variables:
+            response = client.post('/related', json={'request': variable})
+            if response.status_code != 200:
+                raise Exception(f'/related failed for {variable}: {response.status_code}')
+    return run
+
+
+def run_benchmark(folder_path: str, repeat: int = 3, samples: int = 100, seed: int = 0) -> dict:
+    stages = {}
+    relations = compile_relations(read_relations(folder_path))
+
+    stages['load_io'], statements = time_stage(lambda: read_statements(folder_path), repeat)
+    stages['lexer'], tokens = time_stage(lambda: [lexer(relations, statement) for statement in statements], repeat)
+    stages['parse'], parsed_statements = time_stage(lambda: [PKLX().parse(statement_tokens, relations) for statement_tokens in tokens], repeat)
+    stages['load'], _ = time_stage(lambda: load(folder_path, use_cache=False), repeat)
+    stages['statements_to_graph'], graph = time_stage(lambda: statements_to_graph(parsed_statements), repeat)
+
+    variables = [node for node in graph.nodes if graph.nodes[node]['node_type'] == 'variable']
+    sample = random.Random(seed).sample(variables, min(samples, len(variables)))
+    stages['index'], index = time_stage(lambda: VariableIndex(parsed_statements), repeat)
+    stages['extract_from_statements'], _ = time_stage(lambda: [extract_from_statements(parsed_statements, variable, index) for variable in sample], repeat)
+    # the first round fills the response cache of the backend
+    run_related = related_requests(graph, sample)
+    stages['related_uncached'], _ = time_stage(run_related, 1)
+    stages['related_cached'], _ = time_stage(run_related, repeat)
+
+    return {
+        'counts': {'statements': len(statements), 'nodes': graph.number_of_nodes(), 'edges': graph.number_of_edges(), 'variables': len(variables), 'samples': len(sample)},
+        'stages': stages
+    }
+
+
+def environment() -> dict:
+    try:
+        pklx_version = version('pklx')
+    except PackageNotFoundError:
+        pklx_version = None
+    return {'pklx': pklx_version, 'python': platform.python_version(), 'platform': platform.platform()}
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> List[str]:
+    # returns the stages that got slower than the baseline by more than the threshold factor
+    regressions = []
+    if results.get('corpus') != baseline.get('corpus'):
+        print('Warning: the baseline was measured on a different corpus', file=sys.stderr)
+    print(f'{"stage":>24} {"baseline":>12} {"current":>12} {"ratio":>8}')
+    for stage, result in results['stages'].items():
+        if stage not in baseline['stages']:
+            continue
+        before = baseline['stages'][stage]['seconds']
+        after = result['seconds']
+        ratio = after / before if before > 0 else float('inf')
+        marker = ' <-' if ratio > threshold else ''
+        print(f'{stage:>24} {before * 1000:10.1f}ms {after * 1000:10.1f}ms {ratio:8.2f}{marker}')
+        if ratio > threshold:
+            regressions.append(stage)
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark every stage of the PKLX pipeline on a synthetic corpus')
+    add_corpus_arguments(parser)
+    parser.add_argument('--folder', type=str, help='Use an existing data folder instead of generating a corpus')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of runs per stage, the best run counts')
+    parser.add_argument('--samples', type=int, default=100, help='Number of variables used for extract_from_statements and /related')
+    parser.add_argument('--output', type=str, help='Write the results to a JSON file')
+    parser.add_argument('--baseline', type=str, help='Compare the results with a JSON file written by --output')
+    parser.add_argument('--threshold', type=float, default=1.2, help='Slowdown factor above which a stage counts as regression')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temporary_folder:
+        if args.folder is not None:
+            folder_path = args.folder
+            corpus = {'folder': args.folder}
+        else:
+            folder_path = temporary_folder
+            corpus = generate_corpus(folder_path, args.files, args.statements, args.relations, args.depth, args.named, args.variables, args.seed)
+        results = {'environment': environment(), 'corpus': corpus, 'repeat': args.repeat}
+        results.update(run_benchmark(folder_path, args.repeat, args.samples, args.seed))
+
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=4)
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as file:
+            baseline = json.load(file)
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+    else:
+        for stage, result in results['stages'].items():
+            print(f'{stage:>24} {result["seconds"] * 1000:10.1f}ms')
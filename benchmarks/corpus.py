@@ -0,0 +1,87 @@
+import argparse
+import os
+import random
+from typing import List
+from pklx.settings import SETTINGS
+
+
+def make_relations(size: int) -> List[str]:
+    # relations of one to three words, the last one is used as unary relation
+    relations = []
+    for i in range(size):
+        words = [f'REL{i}'] + [f'WORD{j}' for j in range(i % 3)]
+        relations.append(' '.join(words))
+    return relations
+
+
+class CorpusGenerator():
+
+    def __init__(self, relations: List[str], depth: int = 3, named: float = 0.1, variables: int = 1000, seed: int = 0):
+        self.binary_relations = relations[:-1] if len(relations) > 1 else relations
+        self.unary_relation = relations[-1]
+        self.depth = depth
+        self.named = named
+        self.variables = [f'Var{i}' for i in range(variables)]
+        # named statements defined so far, later statements may refer to them
+        self.names = []
+        self.random = random.Random(seed)
+
+    def name(self) -> str:
+        # references to named statements join their subgraphs, too many of them make everything one component
+        if self.names and self.random.random() < 0.02:
+            return self.random.choice(self.names)
+        return self.random.choice(self.variables)
+
+    def expression(self, depth: int) -> str:
+        if depth == 0 or self.random.random() < 0.3:
+            return self.name()
+        return f'( {self.knowledge(depth - 1)} )'
+
+    def knowledge(self, depth: int) -> str:
+        if self.random.random() < 0.1:
+            return f'{self.unary_relation} {self.expression(depth)}'
+        return f'{self.expression(depth)} {self.random.choice(self.binary_relations)} {self.expression(depth)}'
+
+    def statement(self) -> str:
+        knowledge = self.knowledge(self.depth)
+        if self.random.random() < self.named:
+            name = f'Named{len(self.names)}'
+            self.names.append(name)
+            return f'{name} = {knowledge}'
+        return knowledge
+
+
+def generate_corpus(folder_path: str, files: int = 100, statements: int = 50, relations: int = 50, depth: int = 3, named: float = 0.1, variables: int = 1000, seed: int = 0) -> dict:
+    delimiter = SETTINGS['DELIMITER']
+    relation_names = make_relations(relations)
+    generator = CorpusGenerator(relation_names, depth, named, variables, seed)
+    os.makedirs(folder_path, exist_ok=True)
+    with open(os.path.join(folder_path, '.ontology'), 'w') as file:
+        for relation in relation_names:
+            file.write(f'{relation} {delimiter} Generated relation\n')
+    # ten files per folder, one statement per line embedded in text
+    for i in range(files):
+        folder = os.path.join(folder_path, f'folder{i // 10}')
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, f'note{i}.md'), 'w') as file:
+            for _ in range(statements):
+                file.write(f'Some text {delimiter} {generator.statement()} {delimiter} more text\n')
+    return {'files': files, 'statements': statements, 'relations': relations, 'depth': depth, 'named': named, 'variables': variables, 'seed': seed}
+
+
+def add_corpus_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--files', type=int, default=100, help='Number of files')
+    parser.add_argument('--statements', type=int, default=50, help='Number of statements per file')
+    parser.add_argument('--relations', type=int, default=50, help='Number of relations in the ontology')
+    parser.add_argument('--depth', type=int, default=3, help='Maximum nesting depth of the statements')
+    parser.add_argument('--named', type=float, default=0.1, help='Share of named statements')
+    parser.add_argument('--variables', type=int, default=1000, help='Number of distinct variables')
+    parser.add_argument('--seed', type=int, default=0)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a synthetic PKLX data folder')
+    parser.add_argument('folder', type=str, help='The folder to write the corpus to')
+    add_corpus_arguments(parser)
+    args = parser.parse_args()
+    generate_corpus(args.folder, args.files, args.statements, args.relations, args.depth, args.named, args.variables, args.seed)
@@ -0,0 +1,199 @@
+from __future__ import annotations
+from typing import Dict, List, TYPE_CHECKING
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+if TYPE_CHECKING:
+    import networkx as nx
+
+
+NODE_TYPES = ['variable', 'binary', 'unary']
+
+
+def require_numpy():
+    if np is None:
+        raise Exception('The graph analytics need numpy, please install it with pip install pklx[analytics]')
+
+
+class CSRGraph():
+    # The knowledge graph as integer arrays: node i is names[i], its outgoing edges go to indices[indptr[i]:indptr[i + 1]]
+    # and its incoming edges come from in_indices[in_indptr[i]:in_indptr[i + 1]]. Operator nodes refer to their relation
+    # by relations[i] (an index into relation_names), variables have -1.
+
+    def __init__(self, names: List[str], node_types, relations, relation_names: List[str], sources, destinations):
+        self.names = names
+        self.index = {name: i for i, name in enumerate(names)}
+        self.node_types = node_types
+        self.relations = relations
+        self.relation_names = relation_names
+        n = len(names)
+        order = np.argsort(sources, kind='stable')
+        self.indptr = np.concatenate(([0], np.cumsum(np.bincount(sources, minlength=n)))).astype(np.int64)
+        self.indices = destinations[order]
+        order = np.argsort(destinations, kind='stable')
+        self.in_indptr = np.concatenate(([0], np.cumsum(np.bincount(destinations, minlength=n)))).astype(np.int64)
+        self.in_indices = sources[order]
+
+    @property
+    def node_count(self) -> int:
+        return len(self.names)
+
+    @property
+    def edge_count(self) -> int:
+        return len(self.indices)
+
+    def edges(self):
+        # source and destination of every edge
+        return np.repeat(np.arange(self.node_count, dtype=self.indices.dtype), np.diff(self.indptr)), self.indices
+
+    def out_degrees(self):
+        return np.diff(self.indptr)
+
+    def in_degrees(self):
+        return np.diff(self.in_indptr)
+
+    def variables(self):
+        return np.flatnonzero(self.node_types == NODE_TYPES.index('variable'))
+
+
+def to_csr(graph: nx.DiGraph) -> CSRGraph:
+    require_numpy()
+    names = list(graph.nodes)
+    index = {name: i for i, name in enumerate(names)}
+    type_ids = {node_type: i for i, node_type in enumerate(NODE_TYPES)}
+    relation_ids = {}
+    node_types = []
+    relations = []
+    for _, attributes in graph.nodes(data=True):
+        node_types.append(type_ids[attributes['node_type']])
+        relations.append(relation_ids.setdefault(attributes['label'], len(relation_ids)) if 'label' in attributes else -1)
+    edges = np.array([index[node] for edge in graph.edges for node in edge], dtype=np.int32).reshape(-1, 2)
+    return CSRGraph(names, np.array(node_types, dtype=np.int8), np.array(relations, dtype=np.int32), list(relation_ids), edges[:, 0], edges[:, 1])
+
+
+def summarize(values) -> Dict[str, float]:
+    if len(values) == 0:
+        return {'count': 0}
+    percentiles = np.percentile(values, [50, 90, 99])
+    return {
+        'count': int(len(values)),
+        'min': int(values.min()),
+        'max': int(values.max()),
+        'mean': float(values.mean()),
+        'median': float(percentiles[0]),
+        'p90': float(percentiles[1]),
+        'p99': float(percentiles[2])
+    }
+
+
+def degree_stats(csr: CSRGraph) -> Dict[str, Dict[str, Dict[str, float]]]:
+    # in, out and total degree statistics of every node type
+    degrees = {'in': csr.in_degrees(), 'out': csr.out_degrees()}
+    degrees['total'] = degrees['in'] + degrees['out']
+    stats = {}
+    for i, node_type in enumerate(NODE_TYPES):
+        mask = csr.node_types == i
+        stats[node_type] = {direction: summarize(values[mask]) for direction, values in degrees.items()}
+    return stats
+
+
+def pagerank(csr: CSRGraph, alpha: float = 0.85, max_iter: int = 100, tol: float = 1.0e-6):
+    # power iteration with the same conventions as networkx.pagerank: the rank of nodes without outgoing edges is
+    # distributed evenly and the iteration stops once the l1 change is below node_count * tol
+    n = csr.node_count
+    if n == 0:
+        return np.zeros(0)
+    sources, destinations = csr.edges()
+    out_degrees = csr.out_degrees()
+    dangling = out_degrees == 0
+    weights = 1.0 / np.maximum(out_degrees, 1)
+    rank = np.full(n, 1.0 / n)
+    for _ in range(max_iter):
+        previous = rank
+        rank = alpha * np.bincount(destinations, weights=(previous * weights)[sources], minlength=n)
+        rank += (alpha * previous[dangling].sum() + 1.0 - alpha) / n
+        if np.abs(rank - previous).sum() < n * tol:
+            return rank
+    raise Exception(f'PageRank did not converge after {max_iter} iterations')
+
+
+def connected_components(csr: CSRGraph):
+    # weakly connected components by hooking the roots of both ends of every edge to the smaller one and pointer
+    # jumping until every node points to its root; returns the component of every node numbered from 0
+    labels = np.arange(csr.node_count)
+    sources, destinations = csr.edges()
+    while True:
+        source_labels = labels[sources]
+        destination_labels = labels[destinations]
+        different = source_labels != destination_labels
+        if not different.any():
+            break
+        low = np.minimum(source_labels[different], destination_labels[different])
+        high = np.maximum(source_labels[different], destination_labels[different])
+        np.minimum.at(labels, high, low)
+        while True:
+            jumped = labels[labels]
+            if np.array_equal(jumped, labels):
+                break
+            labels = jumped
+    return np.unique(labels, return_inverse=True)[1]
+
+
+def relation_histogram(csr: CSRGraph) -> Dict[str, int]:
+    # number of uses of every relation, most used first
+    counts = np.bincount(csr.relations[csr.relations >= 0], minlength=len(csr.relation_names))
+    return {csr.relation_names[i]: int(counts[i]) for i in np.argsort(-counts, kind='stable')}
+
+
+def top_variables(csr: CSRGraph, scores, top: int = 10) -> List[tuple]:
+    variables = csr.variables()
+    best = variables[np.argsort(-scores[variables], kind='stable')[:top]]
+    return [(csr.names[i], float(scores[i])) for i in best]
+
+
+def analyze(graph: nx.DiGraph, top: int = 10, alpha: float = 0.85) -> dict:
+    csr = to_csr(graph)
+    ranks = pagerank(csr, alpha)
+    components = connected_components(csr)
+    sizes = np.bincount(components) if csr.node_count else np.zeros(0, dtype=np.int64)
+    variable_components = np.bincount(components[csr.variables()], minlength=len(sizes))
+    return {
+        'nodes': csr.node_count,
+        'edges': csr.edge_count,
+        'variables': int(len(csr.variables())),
+        'degrees': degree_stats(csr),
+        'top_degrees': top_variables(csr, csr.in_degrees() + csr.out_degrees(), top),
+        'top_pagerank': top_variables(csr, ranks, top),
+        'components': {
+            'count': int(len(sizes)),
+            'largest': int(sizes.max()) if len(sizes) else 0,
+            'largest_variables': int(variable_components.max()) if len(sizes) else 0,
+            'sizes': summarize(sizes)
+        },
+        'relations': relation_histogram(csr)
+    }
+
+
+def report(results: dict) -> str:
+    lines = [f'{results["nodes"]} nodes ({results["variables"]} variables), {results["edges"]} edges', '']
+    lines.append(f'{"degree":<20} {"count":>8} {"min":>6} {"median":>8} {"mean":>8} {"p99":>8} {"max":>8}')
+    for node_type, directions in results['degrees'].items():
+        for direction, stats in directions.items():
+            if stats['count']:
+                lines.append(f'{node_type + " " + direction:<20} {stats["count"]:>8} {stats["min"]:>6} {stats["median"]:8.1f} {stats["mean"]:8.2f} {stats["p99"]:8.1f} {stats["max"]:>8}')
+    components = results['components']
+    lines.append('')
+    lines.append(f'{components["count"]} connected components, the largest has {components["largest"]} nodes ({components["largest_variables"]} variables)')
+    for title, key, value_format in (('most connected variables', 'top_degrees', '{:>10.0f}'), ('highest PageRank', 'top_pagerank', '{:>10.6f}')):
+        lines.append('')
+        lines.append(title)
+        for name, score in results[key]:
+            lines.append(f'{value_format.format(score)}  {name}')
+    lines.append('')
+    lines.append('relations')
+    for name, count in results['relations'].items():
+        lines.append(f'{count:>10}  {name}')
+    return '\n'.join(lines)
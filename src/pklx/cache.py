@@ -0,0 +1,142 @@
+import gc
+import io
+import os
+import hashlib
+import pickle
+from typing import List, Optional
+
+
+CACHE_FILE = 'parse-cache'
+CACHE_VERSION = 3
+
+
+class ParseCache():
+
+    def __init__(self, folder_path: str, relations: List[str], delimiter: str):
+        self.path = os.path.join(cache_folder(folder_path), CACHE_FILE)
+        # the parsed statements depend on the ontology and the delimiter, a change of either invalidates everything
+        self.key = (CACHE_VERSION, digest('\n'.join(relations).encode()), delimiter)
+        self.entries = {}
+        self.seen = set()
+        self.hits = 0
+        self.misses = 0
+        self.dirty = False
+        try:
+            with open(self.path, 'rb') as file:
+                key, entries = load_pickle(file)
+            if key == self.key:
+                self.entries = entries
+            else:
+                self.dirty = True
+        except FileNotFoundError:
+            pass
+        except Exception:
+            # a broken cache is simply rebuilt
+            self.dirty = True
+
+    def get(self, name: str, stat: os.stat_result, content_hash: str = None) -> Optional[dict]:
+        entry = self.entries.get(name)
+        if entry is None:
+            return None
+        if (entry['mtime'], entry['size']) != (stat.st_mtime_ns, stat.st_size):
+            # the file was touched, it is still valid if the content did not change
+            if content_hash is None or entry['hash'] != content_hash:
+                return None
+            entry['mtime'], entry['size'] = stat.st_mtime_ns, stat.st_size
+            self.dirty = True
+        self.seen.add(name)
+        self.hits += 1
+        return entry
+
+    def known_hash(self, name: str) -> Optional[str]:
+        entry = self.entries.get(name)
+        return entry['hash'] if entry is not None else None
+
+    def put(self, name: str, stat: os.stat_result, content_hash: str, statements: List[str], parsed: list) -> dict:
+        entry = {
+            'mtime': stat.st_mtime_ns,
+            'size': stat.st_size,
+            'hash': content_hash,
+            'statements': statements,
+            'parsed': parsed
+        }
+        self.entries[name] = entry
+        self.seen.add(name)
+        self.misses += 1
+        self.dirty = True
+        return entry
+
+    def save(self):
+        # forget files that were deleted since the last load
+        if len(self.seen) != len(self.entries):
+            self.entries = {name: entry for name, entry in self.entries.items() if name in self.seen}
+            self.dirty = True
+        if not self.dirty:
+            return
+        try:
+            with open(self.path + '.tmp', 'wb') as file:
+                pickle.dump((self.key, self.entries), file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(self.path + '.tmp', self.path)
+        except OSError:
+            # the cache is optional, e.g. the data folder might be read-only
+            pass
+        self.dirty = False
+
+
+def cache_folder(folder_path: str) -> str:
+    # The cache files of a data folder are pickles, which can run code when they are loaded. They are kept in a folder
+    # of the user (e.g. ~/.cache/pklx/<digest of the folder path>) instead of the data folder, which might be shared or
+    # synced with others.
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    path = os.path.join(base, 'pklx', digest(os.path.abspath(folder_path).encode()))
+    try:
+        os.makedirs(path, mode=0o700, exist_ok=True)
+    except OSError:
+        # like a read-only data folder before, the cache files are then neither read nor written
+        pass
+    return path
+
+
+def digest(content: bytes) -> str:
+    return hashlib.sha1(content).hexdigest()
+
+
+class DigestReader(io.RawIOBase):
+    # passes the bytes of a binary file through and hashes them on the way, so that a file is only read once while it
+    # is parsed; digest() of the whole content equals hexdigest() once everything was read
+
+    def __init__(self, file):
+        self.file = file
+        self.hash = hashlib.sha1()
+        self.size = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        count = self.file.readinto(buffer)
+        if count:
+            self.hash.update(memoryview(buffer)[:count])
+            self.size += count
+        return count
+
+    def hexdigest(self) -> str:
+        return self.hash.hexdigest()
+
+
+def digest_file(file) -> str:
+    hash_object = hashlib.sha1()
+    for chunk in iter(lambda: file.read(2 ** 16), b''):
+        hash_object.update(chunk)
+    return hash_object.hexdigest()
+
+
+def load_pickle(file):
+    # unpickling many small objects is a lot faster without the garbage collector running in between
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return pickle.load(file)
+    finally:
+        if enabled:
+            gc.enable()
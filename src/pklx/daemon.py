@@ -0,0 +1,213 @@
+import json
+import os
+import socket
+import socketserver
+import stat
+import tempfile
+from threading import Lock, Thread
+from typing import Iterable, Iterator, List, Optional, Tuple
+from .cache import digest
+from .parser import extract_from_statements
+from .settings import SETTINGS
+from .snapshot import Snapshot, load_snapshot
+from .watch import FolderWatcher
+
+
+def socket_path(folder_path: str) -> Optional[str]:
+    # One daemon per data folder and settings, None if there is no folder for the socket that only the user can access.
+    # The daemon keeps the settings it was started with, a client with a different delimiter or different INCLUDE or
+    # EXCLUDE patterns does not find it and loads the data folder itself.
+    folder = socket_folder()
+    if folder is None:
+        return None
+    key = json.dumps([os.path.abspath(folder_path), SETTINGS['DELIMITER'], SETTINGS['INCLUDE'], SETTINGS['EXCLUDE']])
+    return os.path.join(folder, f'pklx-{digest(key.encode())[:16]}.sock')
+
+
+def socket_folder() -> Optional[str]:
+    # $XDG_RUNTIME_DIR or a folder of the user in the temporary folder (unix socket paths are short), other users must
+    # not be able to put a socket there that answers instead of the daemon
+    if not hasattr(os, 'getuid'):
+        return None
+    folder = os.environ.get('XDG_RUNTIME_DIR')
+    if not folder:
+        folder = os.path.join(tempfile.gettempdir(), f'pklx-{os.getuid()}')
+        try:
+            os.mkdir(folder, 0o700)
+        except FileExistsError:
+            pass
+        except OSError:
+            return None
+    return folder if is_private(folder, stat.S_ISDIR) and stat.S_IMODE(os.lstat(folder).st_mode) & 0o077 == 0 else None
+
+
+def is_private(path: str, is_type) -> bool:
+    # whether the path exists, belongs to the user and has the given type, symbolic links are not followed
+    try:
+        path_stat = os.lstat(path)
+    except OSError:
+        return False
+    return path_stat.st_uid == os.getuid() and is_type(path_stat.st_mode)
+
+
+class Connection():
+    # requests are answered one after the other from the state of the data folder when the connection was opened
+
+    def __init__(self, client: socket.socket):
+        self.client = client
+        self.file = client.makefile('rb')
+
+    def request(self, message: dict) -> dict:
+        self.client.sendall(json.dumps(message).encode() + b'\n')
+        line = self.file.readline()
+        if not line:
+            raise ConnectionError('The daemon closed the connection')
+        response = json.loads(line)
+        if 'error' in response:
+            raise Exception(response['error'])
+        return response
+
+    def close(self):
+        self.file.close()
+        self.client.close()
+
+
+def connect(folder_path: str, timeout: float = 1.0) -> Optional[Connection]:
+    # returns None if no daemon is running for the folder, so that the caller can fall back to loading it
+    if not hasattr(socket, 'AF_UNIX'):
+        return None
+    path = socket_path(folder_path)
+    if path is None or not is_private(path, stat.S_ISSOCK):
+        return None
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.settimeout(timeout)
+        client.connect(path)
+    except OSError:
+        client.close()
+        return None
+    # answering might take a while if the daemon is reloading changed files
+    client.settimeout(None)
+    return Connection(client)
+
+
+def request(folder_path: str, message: dict) -> Optional[dict]:
+    connection = connect(folder_path)
+    if connection is None:
+        return None
+    try:
+        return connection.request(message)
+    except OSError:
+        return None
+    finally:
+        connection.close()
+
+
+def collect(folder_path: str, variable: str) -> Optional[List[dict]]:
+    response = request(folder_path, {'command': 'collect', 'variable': variable})
+    return response['statements'] if response is not None else None
+
+
+def collect_many(connection: Connection, variables: Optional[Iterable[str]]) -> Iterator[Tuple[str, List[dict]]]:
+    # all variables of the data folder if variables is None
+    if variables is None:
+        variables = connection.request({'command': 'variables'})['variables']
+    for variable in variables:
+        yield variable, connection.request({'command': 'collect', 'variable': variable})['statements']
+
+
+def format_statement(statement) -> dict:
+    file_name, line = statement.source if statement.source is not None else (None, None)
+    return {'statement': str(statement), 'file': file_name, 'line': line}
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        # one JSON request per line, answered by one JSON line, all from the same snapshot
+        snapshot = None
+        for line in self.rfile:
+            try:
+                if snapshot is None:
+                    snapshot = self.server.current_snapshot()
+                response = self.server.answer(json.loads(line), snapshot)
+            except Exception as e:
+                response = {'error': str(e)}
+            self.wfile.write(json.dumps(response).encode() + b'\n')
+            self.wfile.flush()
+            if self.server.stopping:
+                # only after the answer was sent, serve_forever returns and the process ends
+                Thread(target=self.server.shutdown).start()
+                return
+
+
+if hasattr(socketserver, 'UnixStreamServer'):
+
+    class DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+        def __init__(self, folder_path: str, workers: int = 1):
+            if request(folder_path, {'command': 'ping'}) is not None:
+                raise Exception(f'A daemon is already running for {folder_path}')
+            self.folder_path = folder_path
+            self.workers = workers
+            self.lock = Lock()
+            self.stopping = False
+            # the watcher starts from the state before loading so that no change in between is missed
+            self.watcher = FolderWatcher(folder_path)
+            self.snapshot = load_snapshot(folder_path, with_graph=False, workers=workers)
+            path = socket_path(folder_path)
+            if path is None:
+                raise Exception('No folder for the daemon socket that only the current user can access, set XDG_RUNTIME_DIR')
+            if os.path.lexists(path):
+                if not is_private(path, stat.S_ISSOCK):
+                    raise Exception(f'{path} is not a socket of the current user, remove it to start the daemon')
+                # left behind by a daemon that did not shut down properly
+                os.remove(path)
+            super().__init__(path, RequestHandler)
+            os.chmod(path, 0o600)
+
+        def current_snapshot(self) -> Snapshot:
+            # Every connection reflects the data folder at the time of its first request, changed files are parsed
+            # again and all others are taken from the parse cache. Finding the changes lists and stats every file of
+            # the data folder once per connection (a few milliseconds for thousands of files), a reload reuses these
+            # stats for the snapshot instead of listing the folder again.
+            with self.lock:
+                changed_files = self.watcher.changes()
+                if changed_files:
+                    self.snapshot = load_snapshot(self.folder_path, with_graph=False, workers=self.workers, files=self.watcher.state)
+                    print(f'Reloaded {self.snapshot.statement_count} statements after {len(changed_files)} changed files')
+                return self.snapshot
+
+        def answer(self, message: dict, snapshot: Snapshot) -> dict:
+            command = message.get('command')
+            if command == 'ping':
+                return {'statements': snapshot.statement_count}
+            if command == 'collect':
+                extracted_statements = extract_from_statements(snapshot.statements, message['variable'], snapshot.index)
+                return {'statements': [format_statement(statement) for statement in extracted_statements]}
+            if command == 'variables':
+                return {'variables': list(snapshot.index.variables())}
+            if command == 'stop':
+                self.stopping = True
+                return {}
+            raise Exception(f'Invalid command: {command}')
+
+        def serve(self):
+            print(f'Serving {self.snapshot.statement_count} statements from {self.folder_path} on {self.server_address}')
+            try:
+                self.serve_forever()
+            finally:
+                self.server_close()
+                if is_private(self.server_address, stat.S_ISSOCK):
+                    os.remove(self.server_address)
+
+
+def serve(folder_path: str, workers: int = 1):
+    if not hasattr(socketserver, 'UnixStreamServer'):
+        raise Exception('The daemon needs unix sockets, which are not available on this platform')
+    DaemonServer(folder_path, workers).serve()
+
+
+def stop(folder_path: str) -> bool:
+    return request(folder_path, {'command': 'stop'}) is not None
@@ -0,0 +1,223 @@
+import gzip
+import io
+import json
+import os
+import sys
+from typing import Callable, Dict, Iterable, Iterator, List, Set, Tuple
+from urllib.parse import quote
+from xml.sax.saxutils import escape, quoteattr
+from .objects import PKLX, Binary, GraphParts, Name, NestedExpression, Statement, Unary, add_statement, node_ids
+from .parser import SNIFF_SIZE, compile_relations, is_binary, list_files, load_files, load_relations, parse_statement, split_statements
+from .settings import SETTINGS
+from . import profiling
+
+
+# The data folder is exported one statement at a time, without building the knowledge graph: the nodes and edges of
+# every statement are written as soon as it is parsed. Only the anchors of named statements and the names of the
+# variables (so that every variable is written once) are kept, the memory grows with the vocabulary and not with the
+# number of statements.
+
+# IRIs of the N-Triples export, e.g. urn:pklx:variable/Solar%20System
+BASE = 'urn:pklx:'
+RDF = 'http://www.w3.org/1999/02/22-rdf-syntax-ns#'
+RDFS = 'http://www.w3.org/2000/01/rdf-schema#'
+
+# node attributes of the knowledge graph
+GRAPHML_KEYS = ('node_type', 'label', 'variable', 'file')
+
+
+def graph_parts(folder_path: str, workers: int = 1) -> Iterator[Tuple[PKLX, str, GraphParts]]:
+    # every statement of the data folder with its anchor and the nodes and edges it adds to the knowledge graph, in the
+    # order of load
+    file_names = list_files(folder_path)
+    relations = load_relations(file_names)
+    file_names = [file_name for file_name in file_names if os.path.split(file_name)[-1] != '.ontology']
+    names = [os.path.relpath(file_name, folder_path).replace(os.sep, '/') for file_name in file_names]
+    matcher = compile_relations(relations)
+    with profiling.phase('anchors') as counts:
+        files, anchors = named_anchors(file_names, names, matcher)
+        counts['anchors'] = len(anchors)
+    for name, (_, _, parsed_statements) in zip(names, load_files(file_names, names, [None] * len(file_names), matcher, workers)):
+        for i, statement in enumerate(parsed_statements):
+            parts = ExportParts()
+            anchor = add_statement(parts, statement, anchors, f'{files[name]}#{i}')
+            add_operands(statement, anchors, node_ids(f'{files[name]}#{i}'), parts.operands)
+            yield statement, anchor, parts
+
+
+class ExportParts(GraphParts):
+    # the nodes and edges of a statement and the operands of its operators
+
+    def __init__(self):
+        super().__init__()
+        # operator -> (left operand or None for unary operators, right operand)
+        self.operands = {}
+
+
+def add_operands(knowledge, anchors: Dict[str, str], ids: Iterator[str], operands: Dict[str, Tuple[str, str]]) -> str:
+    # walks the statement like add_to_graph (operators are numbered in pre-order, names are replaced by anchors) and
+    # returns its anchor; the edges alone can not tell the operands apart, e.g. in A = A IS B the left operand of the
+    # anchor is the anchor itself
+    if type(knowledge) in (Statement, NestedExpression):
+        return add_operands(knowledge.knowledge, anchors, ids, operands)
+    if type(knowledge) == Name:
+        return anchors.get(knowledge.name, knowledge.name)
+    node = next(ids)
+    if type(knowledge) == Binary:
+        left = add_operands(knowledge.left_expression, anchors, ids, operands)
+        operands[node] = (left, add_operands(knowledge.right_expression, anchors, ids, operands))
+    elif type(knowledge) == Unary:
+        operands[node] = (None, add_operands(knowledge.right_expression, anchors, ids, operands))
+    else:
+        raise Exception(f'Invalid statement: {knowledge}')
+    return node
+
+
+def named_anchors(file_names: List[str], names: List[str], matcher) -> Tuple[Dict[str, int], Dict[str, str]]:
+    # the file numbers of statement_prefixes and the anchors of statement_anchors, which are needed before the first
+    # statement is exported; only statements with a '=' can be named, all others are not parsed
+    files = {}
+    anchors = {}
+    for file_name, name in zip(file_names, names):
+        with open(file_name, 'rb') as file:
+            if is_binary(file.peek(SNIFF_SIZE)[:SNIFF_SIZE]):
+                continue
+            statements, _ = split_statements(file_name, io.TextIOWrapper(file), SETTINGS['DELIMITER'])
+        if statements:
+            files[name] = len(files)
+        for i, statement in enumerate(statements):
+            if '=' not in statement:
+                continue
+            parsed_statement = parse_statement(matcher, statement)
+            if type(parsed_statement) == Statement and parsed_statement.variable.name not in anchors:
+                anchors[parsed_statement.variable.name] = next(node_ids(f'{files[name]}#{i}'))
+    return files, anchors
+
+
+def new_nodes(parts: GraphParts, variables: Set[str]) -> Iterator[Tuple[str, dict]]:
+    # the nodes of a statement, variables only the first time they appear
+    for node, attributes in parts.nodes.items():
+        if attributes['node_type'] == 'variable':
+            if node in variables:
+                continue
+            variables.add(node)
+        yield node, attributes
+
+
+def jsonl_lines(statements: Iterable[Tuple[PKLX, str, GraphParts]]) -> Iterator[str]:
+    # one node or edge per line, operators with the file (one of their attributes) and line of their statement
+    variables = set()
+    for statement, _, parts in statements:
+        for node, attributes in new_nodes(parts, variables):
+            record = {'type': 'node', 'id': node, **attributes}
+            if attributes['node_type'] != 'variable':
+                record['line'] = statement.source[1]
+            yield json.dumps(record) + '\n'
+        for source, destination in parts.edges:
+            yield json.dumps({'type': 'edge', 'source': source, 'target': destination}) + '\n'
+
+
+def graphml_lines(statements: Iterable[Tuple[PKLX, str, GraphParts]]) -> Iterator[str]:
+    # the knowledge graph as networkx.write_graphml would write it, nodes and edges in the order of the statements
+    yield '<?xml version="1.0" encoding="utf-8"?>\n'
+    yield ('<graphml xmlns="http://graphml.graphdrawing.org/xmlns" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+           'xsi:schemaLocation="http://graphml.graphdrawing.org/xmlns http://graphml.graphdrawing.org/xmlns/1.0/graphml.xsd">\n')
+    for key in GRAPHML_KEYS:
+        yield f'  <key id="{key}" for="node" attr.name="{key}" attr.type="string" />\n'
+    yield '  <graph edgedefault="directed">\n'
+    variables = set()
+    for _, _, parts in statements:
+        for node, attributes in new_nodes(parts, variables):
+            data = ''.join(f'<data key="{key}">{escape(value)}</data>' for key, value in attributes.items())
+            yield f'    <node id={quoteattr(node)}>{data}</node>\n'
+        for source, destination in parts.edges:
+            yield f'    <edge source={quoteattr(source)} target={quoteattr(destination)} />\n'
+    yield '  </graph>\n</graphml>\n'
+
+
+def ntriples_lines(statements: Iterable[Tuple[PKLX, str, ExportParts]], base: str = BASE) -> Iterator[str]:
+    # Every operator is written as a reified statement (rdf:subject, rdf:predicate and rdf:object, without a subject
+    # for unary operators) whose subject and object are variables or other operators, like in the knowledge graph.
+    # Binary statements that are not part of another statement are also written as a plain triple. Variables,
+    # relations and named statements are labeled with their names.
+    labeled = set()
+    for _, anchor, parts in statements:
+        for node, attributes in parts.nodes.items():
+            if attributes['node_type'] == 'variable':
+                if node not in labeled:
+                    labeled.add(node)
+                    yield triple(node_iri(base, node), f'<{RDFS}label>', literal(node))
+                continue
+            subject = node_iri(base, node)
+            predicate = relation_iri(base, attributes['label'])
+            # relations and variables never share a name, the lexer always reads such a name as the relation
+            if attributes['label'] not in labeled:
+                labeled.add(attributes['label'])
+                yield triple(predicate, f'<{RDFS}label>', literal(attributes['label']))
+            if attributes['node_type'] == 'binary':
+                yield triple(subject, f'<{RDF}type>', f'<{RDF}Statement>')
+                yield triple(subject, f'<{RDF}subject>', node_iri(base, parts.operands[node][0]))
+            else:
+                yield triple(subject, f'<{RDF}type>', f'<{base}UnaryStatement>')
+            yield triple(subject, f'<{RDF}predicate>', predicate)
+            yield triple(subject, f'<{RDF}object>', node_iri(base, parts.operands[node][1]))
+            if 'variable' in attributes:
+                yield triple(subject, f'<{RDFS}label>', literal(attributes['variable']))
+        if parts.nodes[anchor]['node_type'] == 'binary':
+            left, right = parts.operands[anchor]
+            yield triple(node_iri(base, left), relation_iri(base, parts.nodes[anchor]['label']), node_iri(base, right))
+
+
+def node_iri(base: str, node: str) -> str:
+    # operator ids always contain a '#', variable names never do
+    return f'<{base}statement/{quote(node, safe="")}>' if '#' in node else f'<{base}variable/{quote(node, safe="")}>'
+
+
+def relation_iri(base: str, relation: str) -> str:
+    return f'<{base}relation/{quote(relation, safe="")}>'
+
+
+def literal(text: str) -> str:
+    return '"' + text.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n').replace('\r', '\\r') + '"'
+
+
+def triple(subject: str, predicate: str, obj: str) -> str:
+    return f'{subject} {predicate} {obj} .\n'
+
+
+FORMATS: Dict[str, Callable[[Iterable[Tuple[PKLX, str, GraphParts]]], Iterator[str]]] = {
+    'jsonl': jsonl_lines,
+    'nt': ntriples_lines,
+    'graphml': graphml_lines,
+}
+
+
+def export_lines(folder_path: str, format: str = 'jsonl', workers: int = 1) -> Iterator[str]:
+    if format not in FORMATS:
+        raise Exception(f'Invalid format: {format}, use {", ".join(FORMATS)}')
+    return FORMATS[format](graph_parts(folder_path, workers))
+
+
+def export_graph(folder_path: str, file: str = None, format: str = 'jsonl', compress: bool = False, workers: int = 1):
+    # writes the lines while they are generated, gzip compressed if requested or if the file ends with .gz
+    lines = export_lines(folder_path, format, workers)
+    compress = compress or file is not None and file.endswith('.gz')
+    with profiling.phase('export') as counts:
+        if file is None:
+            stream = gzip.open(sys.stdout.buffer, 'wt', encoding='utf-8') if compress else sys.stdout
+        else:
+            stream = gzip.open(file, 'wt', encoding='utf-8') if compress else open(file, 'w', encoding='utf-8')
+        try:
+            stream.writelines(count_lines(lines, counts))
+        finally:
+            if stream is not sys.stdout:
+                stream.close()
+            else:
+                stream.flush()
+
+
+def count_lines(lines: Iterable[str], counts: Dict[str, int]) -> Iterator[str]:
+    counts['lines'] = 0
+    for line in lines:
+        counts['lines'] += 1
+        yield line
@@ -0,0 +1,53 @@
+from typing import Iterator, List
+from .objects import PKLX, Statement
+
+
+class VariableIndex():
+
+    def __init__(self, statements: List[PKLX]):
+        self.statements = statements
+        # variable -> indices of the statements mentioning it, in corpus order
+        self.mentions = {}
+        statement_variables = []
+        for i, statement in enumerate(statements):
+            # first mention order, a set would order the variables by their hash, which changes from run to run
+            variables = dict.fromkeys(statement.variables())
+            statement_variables.append(variables)
+            for variable in variables:
+                self.mentions.setdefault(variable, []).append(i)
+        # statement index -> named statement variables the statement mentions, following these references collects
+        # the statements needed to understand a variable
+        named = {statement.variable.name for statement in statements if type(statement) == Statement}
+        self.references = {}
+        for i, variables in enumerate(statement_variables):
+            referenced = [variable for variable in variables if variable in named]
+            if referenced:
+                self.references[i] = tuple(referenced)
+
+    def variables(self) -> Iterator[str]:
+        # all variables in the order they are first mentioned
+        return iter(self.mentions)
+
+    def closure(self, variable: str) -> List[int]:
+        # indices of all statements mentioning the variable or a named statement referenced by them
+        names = [variable]
+        done = {variable}
+        indices = set()
+        for name in names:
+            for i in self.mentions.get(name, ()):
+                indices.add(i)
+                for reference in self.references.get(i, ()):
+                    if reference not in done:
+                        done.add(reference)
+                        names.append(reference)
+        return sorted(indices)
+
+    def extract(self, variable: str) -> List[PKLX]:
+        extracted_statements = []
+        extracted = set()
+        for i in self.closure(variable):
+            # the same statement object can occur more than once in the corpus
+            if id(self.statements[i]) not in extracted:
+                extracted.add(id(self.statements[i]))
+                extracted_statements.append(self.statements[i])
+        return extracted_statements
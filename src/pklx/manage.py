@@ -1,17 +1,33 @@
+import sys
+import json
 import argparse
-from .visx.backend import main as main_view
 from pklx.parser import load, extract_from_statements
+from pklx.snapshot import load_snapshot
+from .export import FORMATS, export_graph
 from .settings import SETTINGS
 from .settings import set_settings as internal_set_settings
+from . import daemon, profiling
 
 
-def view():
-    main_view()
+def view(workers=1, watch=False, interval=1.0, profile=False, processes=1, host='127.0.0.1', port=5000, use_store=False, use_cache=True, cache_stats=False):
+    # flask is only needed (and imported) for viewing
+    from .visx.backend import main as main_view
+    main_view(workers=workers, watch=watch, interval=interval, profile=profile, processes=processes, host=host, port=port, use_store=use_store,
+              use_cache=use_cache, cache_stats=cache_stats)
 
 
-def collect(variable, file):
-    relations, statements = load(SETTINGS['FOLDER_PATH'])
-    extracted_statements = extract_from_statements(statements, variable)
+def collect(variable, file, use_cache=True, cache_stats=False, workers=1, profile=False, use_daemon=True, use_store=False):
+    # a running daemon answers without loading the data folder
+    collected = daemon.collect(SETTINGS['FOLDER_PATH'], variable) if use_daemon and use_cache and not profile and not use_store else None
+    if collected is not None:
+        if cache_stats:
+            print('Cache: answered by daemon', file=sys.stderr)
+        extracted_statements = [statement['statement'] for statement in collected]
+        profiler = None
+    else:
+        profiler = profiling.enable() if profile else None
+        statements, index = load_index(use_cache, cache_stats, workers, use_store)
+        extracted_statements = extract_from_statements(statements, variable, index)
     if file is not None:
         statement_text = '\n'.join(map(str, extracted_statements))
         with open(file, 'w') as f:
@@ -19,6 +35,74 @@ def collect(variable, file):
     else:
         for statement in extracted_statements:
             print(statement)
+    if profiler is not None:
+        profiling.disable()
+        print(profiler.report(), file=sys.stderr)
+
+
+def collect_many(variables, file, use_cache=True, cache_stats=False, workers=1, profile=False, use_daemon=True, use_store=False):
+    # collects an iterable of variables (all variables if None) with one load, every statement is written as one JSON
+    # line as soon as its variable is done, so the memory does not grow with the number of variables
+    connection = daemon.connect(SETTINGS['FOLDER_PATH']) if use_daemon and use_cache and not profile and not use_store else None
+    profiler = None
+    output = open(file, 'w') if file is not None else sys.stdout
+    try:
+        if connection is not None:
+            if cache_stats:
+                print('Cache: answered by daemon', file=sys.stderr)
+            results = daemon.collect_many(connection, variables)
+        else:
+            profiler = profiling.enable() if profile else None
+            statements, index = load_index(use_cache, cache_stats, workers, use_store)
+            if variables is None:
+                variables = index.variables()
+            if use_store:
+                # the store keeps the printed statements, they do not have to be parsed again
+                results = ((variable, index.extract_formatted(variable)) for variable in variables)
+            else:
+                results = ((variable, map(daemon.format_statement, extract_from_statements(statements, variable, index))) for variable in variables)
+        for variable, statements in results:
+            for statement in statements:
+                output.write(json.dumps({'variable': variable, **statement}) + '\n')
+            output.flush()
+    finally:
+        if connection is not None:
+            connection.close()
+        if file is not None:
+            output.close()
+    if profiler is not None:
+        profiling.disable()
+        print(profiler.report(), file=sys.stderr)
+
+
+def load_index(use_cache=True, cache_stats=False, workers=1, use_store=False):
+    # the statements and their VariableIndex, or only the store, which answers the same queries from the database
+    if use_store:
+        return None, load_store(use_cache, cache_stats, workers)
+    snapshot = load_statements(use_cache, cache_stats, workers)
+    return snapshot.statements, snapshot.index
+
+
+def load_store(use_cache=True, cache_stats=False, workers=1):
+    # sqlite3 is only imported if the store is used
+    from .store import Store
+    stats = {}
+    store = Store(SETTINGS['FOLDER_PATH'])
+    store.update(workers=workers, rebuild=not use_cache, cache_stats=stats)
+    if cache_stats:
+        print(f'Store: {stats["hits"]} unchanged, {stats["misses"]} parsed files', file=sys.stderr)
+    return store
+
+
+def load_statements(use_cache=True, cache_stats=False, workers=1):
+    stats = {}
+    snapshot = load_snapshot(SETTINGS['FOLDER_PATH'], with_graph=False, use_cache=use_cache, cache_stats=stats, workers=workers)
+    if cache_stats:
+        if snapshot.fresh:
+            print('Cache: loaded from snapshot', file=sys.stderr)
+        elif stats:
+            print(f'Cache: {stats["hits"]} hits, {stats["misses"]} misses', file=sys.stderr)
+    return snapshot
 
 
 def set_settings(key, value):
@@ -26,15 +110,105 @@ def set_settings(key, value):
 
 
 def cmd_view():
-    main_view()
+    parser = argparse.ArgumentParser(description='View the knowledge graph in the browser')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes used for parsing (0 uses all cores)')
+    parser.add_argument('--watch', action='store_true', help='Update the graph when files in the data folder change')
+    parser.add_argument('--interval', type=float, default=1.0, help='Seconds between two checks for changed files')
+    parser.add_argument('--profile', action='store_true', help='Print the time and memory spent in every phase and the slowest files and requests')
+    parser.add_argument('--processes', type=int, default=1, help='Number of processes answering requests, they share the graph')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='Address to listen on, e.g. 0.0.0.0 to share the viewer')
+    parser.add_argument('--port', type=int, default=5000, help='Port to listen on')
+    parser.add_argument('--store', action='store_true', help='Answer requests from an SQLite database in the data folder instead of keeping the graph in memory')
+    parser.add_argument('--no-cache', action='store_true', help='Re-parse all files instead of using the parse cache and the snapshot')
+    parser.add_argument('--cache-stats', action='store_true', help='Print the number of cache hits and misses')
+    args = parser.parse_args()
+    view(workers=args.workers, watch=args.watch, interval=args.interval, profile=args.profile, processes=args.processes, host=args.host, port=args.port, use_store=args.store,
+         use_cache=not args.no_cache, cache_stats=args.cache_stats)
 
 
 def cmd_collect():
-    parser = argparse.ArgumentParser(description='Collect knowledge about a specific variable')
-    parser.add_argument('variable', type=str, help='The variable to collect knowledge about')
+    parser = argparse.ArgumentParser(description='Collect knowledge about specific variables')
+    parser.add_argument('variables', type=str, nargs='*', help='The variables to collect knowledge about, - reads them from stdin (one per line)')
+    parser.add_argument('--all', action='store_true', help='Collect knowledge about all variables')
+    parser.add_argument('--jsonl', action='store_true', help='Write one JSON line (variable, statement, file, line) per statement, the default for more than one variable')
     parser.add_argument('--file', type=str, help='Save the output into a file')
+    parser.add_argument('--no-cache', action='store_true', help='Re-parse all files instead of using the parse cache')
+    parser.add_argument('--cache-stats', action='store_true', help='Print the number of cache hits and misses')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes used for parsing (0 uses all cores)')
+    parser.add_argument('--profile', action='store_true', help='Print the time and memory spent in every phase and the slowest files and statements')
+    parser.add_argument('--no-daemon', action='store_true', help='Load the data folder even if a daemon is running')
+    parser.add_argument('--store', action='store_true', help='Query an SQLite database in the data folder instead of loading all statements into memory')
     args = parser.parse_args()
-    collect(args.variable, args.file)
+    if not args.all and not args.variables:
+        parser.error('either variables or --all are required')
+    options = dict(use_cache=not args.no_cache, cache_stats=args.cache_stats, workers=args.workers, profile=args.profile, use_daemon=not args.no_daemon, use_store=args.store)
+    if args.all:
+        collect_many(None, args.file, **options)
+    elif args.jsonl or len(args.variables) > 1 or args.variables == ['-']:
+        collect_many(read_variables(args.variables), args.file, **options)
+    else:
+        collect(args.variables[0], args.file, **options)
+
+
+def read_variables(variables):
+    for variable in variables:
+        if variable == '-':
+            for line in sys.stdin:
+                if line.strip():
+                    yield line.strip()
+        else:
+            yield variable
+
+
+def analyze(top=10, alpha=0.85, as_json=False, use_cache=True, workers=1):
+    # numpy is optional and only imported for the analytics
+    from . import analytics
+    analytics.require_numpy()
+    snapshot = load_snapshot(SETTINGS['FOLDER_PATH'], with_statements=False, use_cache=use_cache, workers=workers)
+    results = analytics.analyze(snapshot.graph, top=top, alpha=alpha)
+    print(json.dumps(results, indent=4) if as_json else analytics.report(results))
+
+
+def export(file=None, format='jsonl', compress=False, workers=1, profile=False):
+    profiler = profiling.enable() if profile else None
+    export_graph(SETTINGS['FOLDER_PATH'], file, format, compress, workers)
+    if profiler is not None:
+        profiling.disable()
+        print(profiler.report(), file=sys.stderr)
+
+
+def cmd_analyze():
+    parser = argparse.ArgumentParser(description='Print statistics of the knowledge graph: degrees, PageRank, connected components and relations')
+    parser.add_argument('--top', type=int, default=10, help='Number of variables listed by degree and PageRank')
+    parser.add_argument('--alpha', type=float, default=0.85, help='Damping factor of PageRank')
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+    parser.add_argument('--no-cache', action='store_true', help='Re-parse all files instead of using the parse cache')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes used for parsing (0 uses all cores)')
+    args = parser.parse_args()
+    analyze(top=args.top, alpha=args.alpha, as_json=args.json, use_cache=not args.no_cache, workers=args.workers)
+
+
+def cmd_export():
+    parser = argparse.ArgumentParser(description='Export the knowledge graph as JSON lines, N-Triples or GraphML without keeping it in memory')
+    parser.add_argument('--format', type=str, default='jsonl', choices=list(FORMATS), help='jsonl (one node or edge per line), nt (N-Triples) or graphml')
+    parser.add_argument('--file', type=str, help='Save the output into a file instead of printing it')
+    parser.add_argument('--gzip', action='store_true', help='Compress the output with gzip, the default for files ending with .gz')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes used for parsing (0 uses all cores)')
+    parser.add_argument('--profile', action='store_true', help='Print the time and memory spent in every phase and the slowest files and statements')
+    args = parser.parse_args()
+    export(file=args.file, format=args.format, compress=args.gzip, workers=args.workers, profile=args.profile)
+
+
+def cmd_daemon():
+    parser = argparse.ArgumentParser(description='Keep the data folder loaded and answer pklx-collect from memory')
+    parser.add_argument('--stop', action='store_true', help='Stop the daemon that is running for the data folder')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes used for parsing (0 uses all cores)')
+    args = parser.parse_args()
+    if args.stop:
+        if not daemon.stop(SETTINGS['FOLDER_PATH']):
+            print(f'No daemon is running for {SETTINGS["FOLDER_PATH"]}')
+    else:
+        daemon.serve(SETTINGS['FOLDER_PATH'], workers=args.workers)
 
 
 def cmd_set_settings():
@@ -65,7 +239,7 @@ if __name__ == '__main__':
             for statement in extracted_statements:
                 print(statement)
     if args.view:
-        main_view()
+        view()
     if args.settings is not None:
         for i in range(0, len(args.settings), 2):
             key = args.settings[i]
@@ -1,49 +1,69 @@
-import networkx as nx
-from typing import Tuple
-import uuid
-from typing import List
+from __future__ import annotations
+import sys
+import time
+from typing import Tuple, TYPE_CHECKING
+from itertools import count
+from typing import Dict, Iterator, List, Optional, Union
+from weakref import WeakValueDictionary
+from . import profiling
+
+if TYPE_CHECKING:
+    import networkx as nx
 
 
 class ParsingException(Exception):
     pass
 
 
-class PKLX():
+# names and operators of all parsed statements, every variable and relation is kept only once
+LEAVES = WeakValueDictionary()
+
 
-    def parse(self, tokens: List[str], relations: List[str]) -> 'PKLX':
-        try:
-            return Statement().parse(tokens, relations)
-        except ParsingException:
-            pass
-        try:
-            return Knowledge().parse(tokens, relations)
-        except ParsingException:
-            pass
-        raise ParsingException(f"Could not parse PKLX: {tokens}")
+class PKLX():
+    # the nodes are kept in memory for every statement of the data folder, slots keep them small
+    __slots__ = ('source',)
+
+    def __init__(self):
+        # (file, line) the statement was loaded from, only set on top level statements, which are never shared
+        self.source = None
+
+    def parse(self, tokens: List[str], relations: List[str], shared: Dict[tuple, 'PKLX'] = None) -> 'PKLX':
+        # sub-expressions in shared are reused, e.g. to share them between the statements of one file
+        profiler = profiling.PROFILER
+        if profiler is not None:
+            start = time.perf_counter()
+        parsed = TokenParser(tokens, relations, shared).pklx() if type(tokens) == list else None
+        if profiler is not None:
+            profiler.add('parse', time.perf_counter() - start, tokens=len(tokens))
+        if parsed is None:
+            raise ParsingException(f"Could not parse PKLX: {tokens}")
+        return parsed
 
 
 class Statement(PKLX):
-    
+    __slots__ = ('variable', 'knowledge')
+
     def __init__(self, name=None, knowledge=None):
+        super().__init__()
         self.variable = name
         self.knowledge = knowledge
 
     def parse(self, tokens: List[str], relations: List[str]) -> PKLX:
-        if type(tokens) != list or len(tokens) == 0:
-            raise ParsingException(f"Could not parse Statement: {tokens}")
-        try:
-            assert tokens[1] == '='
-            self.variable = Name().parse(tokens[0], relations)
-            self.knowledge = Knowledge().parse(tokens[2:], relations)
-            return self
-        except (AssertionError, ParsingException):
+        parsed = TokenParser(tokens, relations).statement(0, len(tokens)) if type(tokens) == list else None
+        if parsed is None:
             raise ParsingException(f"Could not parse Statement: {tokens}")
+        return parsed
 
     def to_graph(self) -> Tuple[str, nx.DiGraph]:
-        anchor, graph = self.knowledge.to_graph()
-        graph.nodes[anchor]['variable'] = self.variable.name
+        graph = new_graph()
+        anchor = self.add_to_graph(graph, {}, node_ids('#0'))
         return anchor, graph
 
+    def add_to_graph(self, graph: nx.DiGraph, anchors: Dict[str, str], node_ids: Iterator[str]) -> str:
+        anchor = self.knowledge.add_to_graph(graph, anchors, node_ids)
+        graph.nodes[anchor]['variable'] = self.variable.name
+        return anchor
+
     def contains(self, variable: str) -> bool:
         if self.variable.contains(variable):
             return True
@@ -51,64 +71,53 @@ class Statement(PKLX):
             return True
         return False
 
+    def variables(self) -> Iterator[str]:
+        yield from self.variable.variables()
+        yield from self.knowledge.variables()
+
     def __repr__(self):
         return f"{self.variable} = {self.knowledge}"
 
 
 class Knowledge(PKLX):
-    
+    __slots__ = ()
+
     def parse(self, tokens: List[str], relations: List[str]) -> PKLX:
-        try:
-            return Binary().parse(tokens, relations)
-        except ParsingException:
-            pass
-        try:
-            return Unary().parse(tokens, relations)
-        except ParsingException:
-            pass
-        raise ParsingException(f"Could not parse Knowledge: {tokens}")
+        parsed = TokenParser(tokens, relations).knowledge(0, len(tokens)) if type(tokens) == list else None
+        if parsed is None:
+            raise ParsingException(f"Could not parse Knowledge: {tokens}")
+        return parsed
 
 
 class Binary(Knowledge):
-    
+    __slots__ = ('left_expression', 'binary_operator', 'right_expression')
+
     def __init__(self, left_expression=None, binary_operator=None, right_expression=None):
+        super().__init__()
         self.left_expression = left_expression
         self.binary_operator = binary_operator
         self.right_expression = right_expression
 
     def parse(self, tokens: List[str], relations: List[str]) -> PKLX:
-        if type(tokens) != list or len(tokens) == 0:
-            raise ParsingException(f"Could not parse Binary: {tokens}")
-        try:
-            if tokens[0] == '(':
-                # Find the matching closing parenthesis
-                open_parentheses = 0
-                for i, token in enumerate(tokens):
-                    if token == '(':
-                        open_parentheses += 1
-                    if token == ')':
-                        open_parentheses -= 1
-                        if open_parentheses == 0:
-                            break
-                self.left_expression = NestedExpression().parse(tokens[0:i+1], relations)
-                self.binary_operator = Binop().parse(tokens[i+1], relations)
-                self.right_expression = Expression().parse(tokens[i+2:], relations)
-            else:
-                self.left_expression = Expression().parse([tokens[0]], relations)
-                self.binary_operator = Binop().parse(tokens[1], relations)
-                self.right_expression = Expression().parse(tokens[2:], relations)
-            return self
-        except ParsingException:
+        parsed = TokenParser(tokens, relations).binary(0, len(tokens)) if type(tokens) == list else None
+        if parsed is None:
             raise ParsingException(f"Could not parse Binary: {tokens}")
+        return parsed
 
     def to_graph(self) -> Tuple[str, nx.DiGraph]:
-        left_expression_anchor, left_expression_graph = self.left_expression.to_graph()
-        right_expression_anchor, right_expression_graph = self.right_expression.to_graph()
-        binary_operator_anchor, binary_operator_graph = self.binary_operator.to_graph()
-        graph = nx.compose_all([left_expression_graph, right_expression_graph, binary_operator_graph])
+        graph = new_graph()
+        anchor = self.add_to_graph(graph, {}, node_ids('#0'))
+        return anchor, graph
+
+    def add_to_graph(self, graph: nx.DiGraph, anchors: Dict[str, str], node_ids: Iterator[str]) -> str:
+        # operators are numbered in pre-order, so the anchor of a statement is always its first id
+        binary_operator_anchor = next(node_ids)
+        left_expression_anchor = self.left_expression.add_to_graph(graph, anchors, node_ids)
+        right_expression_anchor = self.right_expression.add_to_graph(graph, anchors, node_ids)
+        self.binary_operator.add_to_graph(graph, binary_operator_anchor)
         graph.add_edge(left_expression_anchor, binary_operator_anchor)
         graph.add_edge(binary_operator_anchor, right_expression_anchor)
-        return binary_operator_anchor, graph
+        return binary_operator_anchor
 
     def contains(self, variable: str) -> bool:
         if self.left_expression.contains(variable):
@@ -117,83 +126,93 @@ class Binary(Knowledge):
             return True
         return False
 
+    def variables(self) -> Iterator[str]:
+        yield from self.left_expression.variables()
+        yield from self.right_expression.variables()
+
     def __repr__(self):
         return f"{self.left_expression} {self.binary_operator} {self.right_expression}"
 
 
 class Unary(Knowledge):
-        
+    __slots__ = ('unary_operator', 'right_expression')
+
     def __init__(self, unary_operator=None, right_expression=None):
+        super().__init__()
         self.unary_operator = unary_operator
         self.right_expression = right_expression
 
     def parse(self, tokens: List[str], relations: List[str]) -> PKLX:
-        if type(tokens) != list or len(tokens) == 0:
-            raise ParsingException(f"Could not parse Unary: {tokens}")
-        try:
-            self.unary_operator = Unop().parse(tokens[0], relations)
-            self.right_expression = Expression().parse(tokens[1:], relations)
-            return self
-        except ParsingException:
+        parsed = TokenParser(tokens, relations).unary(0, len(tokens)) if type(tokens) == list else None
+        if parsed is None:
             raise ParsingException(f"Could not parse Unary: {tokens}")
+        return parsed
 
     def to_graph(self) -> Tuple[str, nx.DiGraph]:
-        right_expression_anchor, right_expression_graph = self.right_expression.to_graph()
-        unary_operator_anchor, unary_operator_graph = self.unary_operator.to_graph()
-        graph = nx.compose(right_expression_graph, unary_operator_graph)
+        graph = new_graph()
+        anchor = self.add_to_graph(graph, {}, node_ids('#0'))
+        return anchor, graph
+
+    def add_to_graph(self, graph: nx.DiGraph, anchors: Dict[str, str], node_ids: Iterator[str]) -> str:
+        unary_operator_anchor = next(node_ids)
+        right_expression_anchor = self.right_expression.add_to_graph(graph, anchors, node_ids)
+        self.unary_operator.add_to_graph(graph, unary_operator_anchor)
         graph.add_edge(unary_operator_anchor, right_expression_anchor)
-        return unary_operator_anchor, graph
+        return unary_operator_anchor
 
     def contains(self, variable: str) -> bool:
         if self.right_expression.contains(variable):
             return True
         return False
 
+    def variables(self) -> Iterator[str]:
+        yield from self.right_expression.variables()
+
     def __repr__(self):
         return f"{self.unary_operator} {self.right_expression}"
 
 
 class Expression():
-    
+    __slots__ = ()
+
     def parse(self, tokens: List[str], relations: List[str]) -> PKLX:
-        if type(tokens) != list or len(tokens) == 0:
-            raise ParsingException(f"Could not parse Expression: {tokens}")
-        try:
-            if len(tokens) == 1:
-                return Name().parse(tokens[0], relations)
-            else:
-                return NestedExpression().parse(tokens, relations)
-        except ParsingException:
+        parsed = TokenParser(tokens, relations).expression(0, len(tokens)) if type(tokens) == list else None
+        if parsed is None:
             raise ParsingException(f"Could not parse Expression: {tokens}")
+        return parsed
 
 
 class NestedExpression(Expression):
+    __slots__ = ('knowledge',)
 
     def __init__(self, knowledge=None):
         self.knowledge = knowledge
 
     def parse(self, tokens: List[str], relations: List[str]) -> PKLX:
-        if type(tokens) != list or len(tokens) == 0:
-            raise ParsingException(f"Could not parse NestedExpression: {tokens}")
-        try:
-            assert tokens[0] == '(' and tokens[-1] == ')'
-            self.knowledge = Knowledge().parse(tokens[1:-1], relations)
-            return self
-        except (AssertionError, ParsingException):
+        parsed = TokenParser(tokens, relations).nested_expression(0, len(tokens)) if type(tokens) == list else None
+        if parsed is None:
             raise ParsingException(f"Could not parse NestedExpression: {tokens}")
+        return parsed
 
     def to_graph(self) -> Tuple[str, nx.DiGraph]:
         return self.knowledge.to_graph()
 
+    def add_to_graph(self, graph: nx.DiGraph, anchors: Dict[str, str], node_ids: Iterator[str]) -> str:
+        return self.knowledge.add_to_graph(graph, anchors, node_ids)
+
     def contains(self, variable: str) -> bool:
         return self.knowledge.contains(variable)
 
+    def variables(self) -> Iterator[str]:
+        yield from self.knowledge.variables()
+
     def __repr__(self):
         return f"( {self.knowledge} )"
 
 
 class Name(Expression):
-        
+    __slots__ = ('name', '__weakref__')
+
     def __init__(self, name=None):
         self.name = name
 
@@ -205,20 +224,30 @@ class Name(Expression):
             raise ParsingException(f"Could not parse Name: {token}")
 
     def to_graph(self) -> Tuple[str, nx.DiGraph]:
-        graph = nx.DiGraph()
-        node = self.name
-        graph.add_node(node, node_type='variable')
+        graph = new_graph()
+        node = self.add_to_graph(graph, {}, node_ids('#0'))
         return node, graph
 
+    def add_to_graph(self, graph: nx.DiGraph, anchors: Dict[str, str], node_ids: Iterator[str]) -> str:
+        # variables that name a statement are represented by the anchor of that statement
+        if self.name in anchors:
+            return anchors[self.name]
+        graph.add_node(self.name, node_type='variable')
+        return self.name
+
     def contains(self, variable: str) -> bool:
         return self.name == variable
+
+    def variables(self) -> Iterator[str]:
+        yield self.name
     
     def __repr__(self):
         return f"{self.name}"
 
 
 class Binop():
-    
+    __slots__ = ('name', '__weakref__')
+
     def __init__(self, name=None):
         self.name = name
 
@@ -230,17 +259,21 @@ class Binop():
             raise ParsingException(f"Could not parse Binop: {token}")
 
     def to_graph(self) -> Tuple[str, nx.DiGraph]:
-        graph = nx.DiGraph()
-        node = str(uuid.uuid4()) + ' ' + self.name
-        graph.add_node(node, node_type='binary')
+        graph = new_graph()
+        node = self.add_to_graph(graph, next(node_ids('#0')))
         return node, graph
 
+    def add_to_graph(self, graph: nx.DiGraph, node: str) -> str:
+        graph.add_node(node, node_type='binary', label=self.name)
+        return node
+
     def __repr__(self):
         return f"{self.name}"
 
 
 class Unop():
-        
+    __slots__ = ('name', '__weakref__')
+
     def __init__(self, name=None):
         self.name = name
 
@@ -252,10 +285,171 @@ class Unop():
             raise ParsingException(f"Could not parse Unop: {token}")
 
     def to_graph(self) -> Tuple[str, nx.DiGraph]:
-        graph = nx.DiGraph()
-        node = str(uuid.uuid4()) + ' ' + self.name
-        graph.add_node(node, node_type='unary')
+        graph = new_graph()
+        node = self.add_to_graph(graph, next(node_ids('#0')))
         return node, graph
 
+    def add_to_graph(self, graph: nx.DiGraph, node: str) -> str:
+        graph.add_node(node, node_type='unary', label=self.name)
+        return node
+
     def __repr__(self):
         return f"{self.name}"
+
+
+def new_graph() -> nx.DiGraph:
+    # networkx is only imported once a graph is built, parsing and extracting statements do not need it
+    import networkx as nx
+    return nx.DiGraph()
+
+
+class GraphParts():
+    # records what statements add to a graph, all add_to_graph methods need, without building a graph
+
+    def __init__(self):
+        self.nodes = {}
+        self.edges = []
+
+    def add_node(self, node: str, **attributes):
+        self.nodes.setdefault(node, {}).update(attributes)
+
+    def add_edge(self, source: str, destination: str):
+        self.edges.append((source, destination))
+
+
+def node_ids(prefix: str) -> Iterator[str]:
+    # operator node ids of one statement, e.g. '2#3.0' for the first operator of the fourth statement in the file with
+    # the number 2 (the path of the file is an attribute of the node), the '#' keeps them apart from variable names
+    return (f'{prefix}.{i}' for i in count())
+
+
+def add_statement(graph: Union[nx.DiGraph, GraphParts], statement: PKLX, anchors: Dict[str, str], prefix: str) -> str:
+    # adds the statement like add_to_graph and the file of the statement to its operators, whose ids are consecutive
+    anchor = statement.add_to_graph(graph, anchors, node_ids(prefix))
+    if statement.source is not None:
+        for node in node_ids(prefix):
+            if node not in graph.nodes:
+                break
+            graph.nodes[node]['file'] = statement.source[0]
+    return anchor
+
+
+class TokenParser():
+    # Predictive parser for the grammar, every rule works on the token range [start, end) and returns None
+    # instead of raising if the range does not match the rule. The first token(s) of a range determine which
+    # alternative applies, so no alternative has to be tried and undone.
+
+    def __init__(self, tokens: List[str], relations: List[str], shared: Dict[tuple, PKLX] = None):
+        self.tokens = tokens
+        self.relations = relations
+        # structurally identical sub-expressions are one object (hash consing), keyed by their class and their
+        # children, which are shared themselves and therefore compared by identity
+        self.shared_nodes = shared if shared is not None else {}
+        # index of the matching closing parenthesis for every opening parenthesis
+        self.matches = {}
+        open_parentheses = []
+        for i, token in enumerate(tokens):
+            if token == '(':
+                open_parentheses.append(i)
+            elif token == ')' and open_parentheses:
+                self.matches[open_parentheses.pop()] = i
+
+    def pklx(self) -> Optional[PKLX]:
+        if len(self.tokens) > 1 and self.tokens[1] == '=':
+            return self.statement(0, len(self.tokens))
+        return self.knowledge(0, len(self.tokens))
+
+    def statement(self, start: int, end: int) -> Optional['Statement']:
+        if end - start < 3 or self.tokens[start + 1] != '=':
+            return None
+        variable = self.name(start)
+        if variable is None:
+            return None
+        knowledge = self.knowledge(start + 2, end)
+        if knowledge is None:
+            return None
+        return Statement(variable, knowledge)
+
+    def shared(self, start: int, end: int, node_class: type, *children) -> PKLX:
+        # everything but the top level statement, which gets its own source, is shared
+        if start == 0 and end == len(self.tokens):
+            return node_class(*children)
+        key = (node_class,) + children
+        node = self.shared_nodes.get(key)
+        if node is None:
+            node = self.shared_nodes[key] = node_class(*children)
+        return node
+
+    def leaf(self, node_class: type, token: str) -> PKLX:
+        key = (node_class, token)
+        node = LEAVES.get(key)
+        if node is None:
+            # interned, so that comparing a name with an interned variable is an identity check
+            node = LEAVES.setdefault(key, node_class(sys.intern(token)))
+        return node
+
+    def knowledge(self, start: int, end: int) -> Optional[PKLX]:
+        if start >= end:
+            return None
+        # a Unary starts with a relation, which can never be the Name or the parenthesis a Binary starts with
+        if self.tokens[start] != '(' and self.tokens[start] in self.relations:
+            return self.unary(start, end)
+        return self.binary(start, end)
+
+    def binary(self, start: int, end: int) -> Optional['Binary']:
+        if start >= end:
+            return None
+        if self.tokens[start] == '(':
+            left_end = self.matches.get(start, end) + 1
+            if left_end > end:
+                return None
+            left_expression = self.nested_expression(start, left_end)
+        else:
+            left_end = start + 1
+            left_expression = self.name(start)
+        if left_expression is None or left_end >= end:
+            return None
+        binary_operator = self.operator(left_end, Binop)
+        if binary_operator is None:
+            return None
+        right_expression = self.expression(left_end + 1, end)
+        if right_expression is None:
+            return None
+        return self.shared(start, end, Binary, left_expression, binary_operator, right_expression)
+
+    def unary(self, start: int, end: int) -> Optional['Unary']:
+        if start >= end:
+            return None
+        unary_operator = self.operator(start, Unop)
+        if unary_operator is None:
+            return None
+        right_expression = self.expression(start + 1, end)
+        if right_expression is None:
+            return None
+        return self.shared(start, end, Unary, unary_operator, right_expression)
+
+    def expression(self, start: int, end: int) -> Optional[PKLX]:
+        if end - start == 1:
+            return self.name(start)
+        return self.nested_expression(start, end)
+
+    def nested_expression(self, start: int, end: int) -> Optional['NestedExpression']:
+        # the parentheses around a nested expression have to match each other
+        if end - start < 2 or self.tokens[start] != '(' or self.matches.get(start) != end - 1:
+            return None
+        knowledge = self.knowledge(start + 1, end - 1)
+        if knowledge is None:
+            return None
+        return self.shared(start, end, NestedExpression, knowledge)
+
+    def name(self, index: int) -> Optional['Name']:
+        token = self.tokens[index]
+        if type(token) == str and token[0].isalpha() and token not in self.relations:
+            return self.leaf(Name, token)
+        return None
+
+    def operator(self, index: int, operator_class: type) -> Optional[PKLX]:
+        token = self.tokens[index]
+        if type(token) == str and token[0].isalpha() and token in self.relations:
+            return self.leaf(operator_class, token)
+        return None
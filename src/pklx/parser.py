@@ -1,126 +1,428 @@
+from __future__ import annotations
+import fnmatch
+import io
 import os
 import re
-from typing import List, Tuple
-from .objects import PKLX, Statement
-import networkx as nx
+import time
+from collections import deque
+from itertools import repeat
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union, TYPE_CHECKING
+from .objects import PKLX, Statement, add_statement, new_graph, node_ids
+from .cache import DigestReader, ParseCache, digest, digest_file
+from .index import VariableIndex
+from . import profiling
 from .settings import SETTINGS
 
+if TYPE_CHECKING:
+    import networkx as nx
 
-def load(folder_path: str) -> Tuple[List[str], List[str]]:
+
+def load(folder_path: str, use_cache: bool = True, cache_stats: Dict[str, int] = None, workers: int = 1) -> Tuple[List[str], List[PKLX]]:
+    with profiling.phase('walk') as counts:
+        file_names = list_files(folder_path)
+        counts['files'] = len(file_names)
+    # the ontology is needed before any statement can be parsed
+    relations = load_relations(file_names)
+    file_names = [file_name for file_name in file_names if os.path.split(file_name)[-1] != '.ontology']
+    matcher = compile_relations(relations)
+
+    # unchanged files are taken from the cache, all others are read and parsed (in parallel if requested)
+    parsed_files = [None] * len(file_names)
+    pending = []
+    with profiling.phase('cache') as counts:
+        cache = ParseCache(folder_path, relations, SETTINGS['DELIMITER']) if use_cache and os.path.isdir(folder_path) else None
+        for i, file_name in enumerate(file_names):
+            name = os.path.relpath(file_name, folder_path).replace(os.sep, '/')
+            stat = os.stat(file_name)
+            entry = cache.get(name, stat) if cache is not None else None
+            if entry is not None:
+                parsed_files[i] = entry['parsed']
+            else:
+                pending.append((i, name, stat))
+        counts['hits'] = len(file_names) - len(pending)
+
+    pending_files = [file_names[i] for i, _, _ in pending]
+    pending_names = [name for _, name, _ in pending]
+    known_hashes = [cache.known_hash(name) if cache is not None else None for _, name, _ in pending]
+    with profiling.phase('load files', files=len(pending)):
+        results = list(load_files(pending_files, pending_names, known_hashes, matcher, workers))
+
+    for (i, name, stat), (content_hash, statements, parsed_statements) in zip(pending, results):
+        if parsed_statements is None:
+            # the file was touched but its content did not change
+            parsed_files[i] = cache.get(name, stat, content_hash)['parsed']
+        else:
+            if cache is not None:
+                cache.put(name, stat, content_hash, statements, parsed_statements)
+            parsed_files[i] = parsed_statements
+
+    if cache is not None:
+        with profiling.phase('cache save'):
+            cache.save()
+        if cache_stats is not None:
+            cache_stats['hits'] = cache.hits
+            cache_stats['misses'] = cache.misses
+    statements = [statement for parsed_statements in parsed_files for statement in parsed_statements]
+    return relations, statements
+
+
+def load_files(file_names: List[str], names: List[str], known_hashes: List[Optional[str]], matcher: 'RelationMatcher', workers: int = 1) -> Iterator[Tuple[str, List[str], List[PKLX]]]:
+    # the results of load_file for every file in order, in parallel if requested
+    if workers is None or workers < 1:
+        workers = os.cpu_count() or 1
+    if workers > 1 and len(file_names) > 1:
+        # the phases and files of the worker processes are not profiled, multiprocessing is only imported if needed
+        from concurrent.futures import ProcessPoolExecutor
+        # the matcher and the delimiter are sent once to every worker, not with every file
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(matcher, SETTINGS['DELIMITER'])) as executor:
+            # only a few files per worker are in flight, unlike executor.map, which submits all files at once and keeps
+            # their results until they are consumed, the memory does not grow with the number of files
+            futures = deque()
+            for file_name, name, known_hash in zip(file_names, names, known_hashes):
+                futures.append(executor.submit(load_worker_file, file_name, name, known_hash))
+                if len(futures) >= 2 * workers:
+                    yield futures.popleft().result()
+            while futures:
+                yield futures.popleft().result()
+    else:
+        yield from map(load_file, file_names, names, known_hashes, repeat(matcher), repeat(SETTINGS['DELIMITER']))
+
+
+# matcher and delimiter of a worker process of load_files
+WORKER_ARGUMENTS: Optional[Tuple['RelationMatcher', str]] = None
+
+
+def init_worker(matcher: 'RelationMatcher', delimiter: str):
+    global WORKER_ARGUMENTS
+    WORKER_ARGUMENTS = (matcher, delimiter)
+
+
+def load_worker_file(file_name: str, name: str, known_hash: str) -> Tuple[str, List[str], List[PKLX]]:
+    return load_file(file_name, name, known_hash, *WORKER_ARGUMENTS)
+
+
+# files written by pklx itself (cache, snapshot, store) start with this prefix
+PKLX_FILE_PREFIX = '.pklx-'
+
+
+# number of bytes at the start of a file that decide whether it is a text file
+SNIFF_SIZE = 8192
+
+
+def list_files(folder_path: str) -> List[str]:
+    return list(walk_files(folder_path))
+
+
+def walk_files(folder_path: str, include: List[str] = None, exclude: List[str] = None) -> Iterator[str]:
+    # Yields the files of the data folder in the order of os.walk. Hidden folders (.git, .obsidian, ...), files written
+    # by pklx and files whose path relative to the data folder does not match an INCLUDE or matches an EXCLUDE pattern
+    # of the settings are skipped, a folder matching an EXCLUDE pattern is skipped as a whole. The .ontology is always
+    # included, no INCLUDE patterns include all files.
+    include = compile_patterns(SETTINGS['INCLUDE'] if include is None else include)
+    exclude = compile_patterns(SETTINGS['EXCLUDE'] if exclude is None else exclude)
+    yield from walk_folder(folder_path, '', include, exclude)
+
+
+def compile_patterns(patterns: List[str]) -> Optional[re.Pattern]:
+    if not patterns:
+        return None
+    return re.compile('|'.join(f'(?:{fnmatch.translate(pattern)})' for pattern in patterns))
+
+
+def walk_folder(path: str, relative_path: str, include: Optional[re.Pattern], exclude: Optional[re.Pattern]) -> Iterator[str]:
+    folders = []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                relative_name = relative_path + entry.name
+                if entry.is_dir():
+                    # like os.walk, symbolic links to folders are not followed
+                    if not entry.name.startswith('.') and not entry.is_symlink() and (exclude is None or not exclude.match(relative_name)):
+                        folders.append((entry.path, relative_name + '/'))
+                elif entry.name == '.ontology':
+                    yield entry.path
+                elif not entry.name.startswith(PKLX_FILE_PREFIX) and (include is None or include.match(relative_name)) and (exclude is None or not exclude.match(relative_name)):
+                    yield entry.path
+    except OSError:
+        # like os.walk, folders that can not be read are skipped
+        return
+    for folder, relative_folder in folders:
+        yield from walk_folder(folder, relative_folder, include, exclude)
+
+
+def is_binary(start: bytes) -> bool:
+    # text in the encodings open() uses for the data folder never contains null bytes, images, PDFs and the like do
+    return b'\0' in start
+
+
+def load_file(file_name: str, name: str, known_hash: str, relations: 'RelationMatcher', delimiter: str) -> Tuple[str, List[str], List[PKLX]]:
+    profiler = profiling.PROFILER
+    if profiler is not None:
+        start = time.perf_counter()
+    with profiling.phase('read') as counts:
+        with open(file_name, 'rb') as file:
+            start_bytes = file.peek(SNIFF_SIZE)[:SNIFF_SIZE]
+            if is_binary(start_bytes):
+                # only the first bytes decide that the file is skipped, so they also identify it for the cache
+                counts['bytes'] = len(start_bytes)
+                content_hash = digest(start_bytes)
+                return (content_hash, None, None) if content_hash == known_hash else (content_hash, [], [])
+            if known_hash is not None:
+                # the file was touched, it is only parsed again if its content changed
+                content_hash = digest_file(file)
+                if content_hash == known_hash:
+                    return content_hash, None, None
+                file.seek(0)
+            # the file is decoded like open(file_name, 'r') would and split line by line while it is read and hashed,
+            # only the statements are kept
+            reader = DigestReader(file)
+            statements, line_numbers = split_statements(file_name, io.TextIOWrapper(io.BufferedReader(reader)), delimiter)
+            content_hash = reader.hexdigest()
+            counts['bytes'] = reader.size
+    parsed_statements = parse_statements(relations, statements)
+    for parsed_statement, line_number in zip(parsed_statements, line_numbers):
+        parsed_statement.source = (name, line_number)
+    if profiler is not None:
+        profiler.record('file', name, time.perf_counter() - start, statements=len(statements), bytes=reader.size)
+    return content_hash, statements, parsed_statements
+
+
+def split_statements(file_name: str, lines: Iterable[str], delimiter: str) -> Tuple[List[str], List[int]]:
     statements = []
+    line_numbers = []
+    for line_number, line in enumerate(lines, 1):
+        # separate statements from text by using the delimiter
+        splitted_line = line.split(delimiter)
+        if len(splitted_line) % 2 == 0:
+            raise Exception(f'Invalid syntax in file: {file_name}, line: {line}')
+        else:
+            statements.extend(splitted_line[1::2])
+            line_numbers.extend([line_number] * (len(splitted_line) // 2))
+    return statements, line_numbers
+
+
+def load_relations(file_names: List[str]) -> List[str]:
     relations = []
-    file_names = [os.path.join(folder, file) for folder, _, files in os.walk(folder_path) for file in files]
     for file_name in file_names:
         if os.path.split(file_name)[-1] == '.ontology':
-            with open(os.path.join(folder_path, file_name), 'r') as file:
+            with open(file_name, 'r') as file:
                 relations = file.readlines()
             relations = parse_relations(relations)
-        else:
-            with open(os.path.join(folder_path, file_name), 'r') as file:
-                lines = file.readlines()
-            for line in lines:
-                # separate statements from text by using the delimiter
-                splitted_line = line.split(SETTINGS['DELIMITER'])
-                if len(splitted_line) % 2 == 0:
-                    raise Exception(f'Invalid syntax in file: {file_name}, line: {line}')
-                else:
-                    statements.extend(splitted_line[1::2])
-    statements = parse_statements(relations, statements)
-    return relations, statements
+    return relations
 
 
 def parse_relations(relations: List[str]) -> List[str]:
     return [relation.split(SETTINGS['DELIMITER'])[0].strip().replace('\n', '') for relation in relations]
 
 
-def lexer(relations: List[str], statement: str) -> List[str]:
-    split_tokens = [token for token in re.split(r'(\W)', statement) if token.strip()]
-    relations = relations.copy()
-    # longer relations should be matched first
-    relations.sort(key=len, reverse=True)
-    # merge as many consecutive tokens into a relation as possible
+class RelationMatcher():
+
+    def __init__(self, relations: List[str]):
+        self.relations = set(relations)
+        # token trie of all relations, a None key marks the end of a relation
+        self.trie = {}
+        for relation in relations:
+            phrase = relation.split()
+            # relations with irregular whitespace can never match the space separated tokens
+            if not phrase or " ".join(phrase) != relation:
+                continue
+            node = self.trie
+            for token in phrase:
+                node = node.setdefault(token, {})
+            node[None] = relation
+
+    def match(self, tokens: List[str], start: int) -> Tuple[str, int]:
+        # returns the longest relation starting at tokens[start] and the number of tokens it spans
+        relation = None
+        length = 0
+        node = self.trie
+        i = start
+        while i < len(tokens):
+            node = node.get(tokens[i])
+            if node is None:
+                break
+            i += 1
+            if None in node:
+                relation = node[None]
+                length = i - start
+        return relation, length
+
+    def __contains__(self, token: str) -> bool:
+        return token in self.relations
+
+
+def compile_relations(relations: Union[List[str], RelationMatcher]) -> RelationMatcher:
+    if isinstance(relations, RelationMatcher):
+        return relations
+    return RelationMatcher(relations)
+
+
+TOKEN_PATTERN = re.compile(r'\w+|[^\w\s]')
+
+
+def lexer(relations: Union[List[str], RelationMatcher], statement: str) -> List[str]:
+    relations = compile_relations(relations)
+    split_tokens = TOKEN_PATTERN.findall(statement)
+    # merge as many consecutive tokens into a relation as possible (longer relations are matched first)
     relation_merged_tokens = []
     i = 0
     while i < len(split_tokens):
-        found = False
-        for phrase in relations:
-            if " ".join(split_tokens[i:i+len(phrase.split())]) == phrase:
-                relation_merged_tokens.append(phrase)
-                i += len(phrase.split())
-                found = True
-                break
-        if not found:
+        relation, length = relations.match(split_tokens, i)
+        if relation is not None:
+            relation_merged_tokens.append(relation)
+            i += length
+        else:
             relation_merged_tokens.append(split_tokens[i])
             i += 1
 
     # merge consecutive alphanumeric tokens that are not relations into one token
     tokens = []
-    current_string = ""
+    current_string = []
     for s in relation_merged_tokens:
         if s.isalnum() and s not in relations:
-            current_string += " " + s
+            current_string.append(s)
         else:
             if current_string:
-                tokens.append(current_string.strip())
-                current_string = ""
+                tokens.append(" ".join(current_string))
+                current_string = []
             tokens.append(s)
     if current_string:
-        tokens.append(current_string.strip())
+        tokens.append(" ".join(current_string))
 
     # remove optional markdown syntax
+    markdown_free_tokens = []
     i = 0
-    while i < len(tokens) - 1:
-        if tokens[i] == '[' and tokens[i+1] == '[':
-            del tokens[i:i+2]
-            continue
-        if tokens[i] == ']' and tokens[i+1] == ']':
-            del tokens[i:i+2]
+    while i < len(tokens):
+        if i < len(tokens) - 1 and tokens[i] in ('[', ']') and tokens[i+1] == tokens[i]:
+            i += 2
             continue
+        markdown_free_tokens.append(tokens[i])
         i += 1
 
-    return tokens
+    return markdown_free_tokens
 
 
-def parse_statements(relations: List[str], statements: List[str]) -> List[PKLX]:
+def parse_statements(relations: Union[List[str], RelationMatcher], statements: List[str]) -> List[PKLX]:
+    relations = compile_relations(relations)
+    profiler = profiling.PROFILER
+    # repeated sub-expressions of the statements are parsed into one shared object
+    shared = {}
     parsed_statements = []
     for statement in statements:
-        parsed_statements.append(parse_statement(relations, statement))
+        if profiler is None:
+            parsed_statements.append(parse_statement(relations, statement, shared))
+        else:
+            parsed_statements.append(profile_statement(profiler, relations, statement, shared))
     return parsed_statements
 
 
-def parse_statement(relations: List[str], statement: str) -> PKLX:
+def profile_statement(profiler: profiling.Profiler, relations: RelationMatcher, statement: str, shared: Dict[tuple, PKLX] = None) -> PKLX:
+    start = time.perf_counter()
+    tokens = lexer(relations, statement)
+    profiler.add('lexer', time.perf_counter() - start, statements=1, tokens=len(tokens))
+    parsed_statement = PKLX().parse(tokens, relations, shared)
+    profiler.record('statement', statement.strip(), time.perf_counter() - start, tokens=len(tokens))
+    return parsed_statement
+
+
+def parse_statement(relations: Union[List[str], RelationMatcher], statement: str, shared: Dict[tuple, PKLX] = None) -> PKLX:
+    relations = compile_relations(relations)
     tokens = lexer(relations, statement)
-    parsed_statement = PKLX().parse(tokens, relations)
+    parsed_statement = PKLX().parse(tokens, relations, shared)
     return parsed_statement
 
 
 def statements_to_graph(statements: List[PKLX]) -> nx.DiGraph:
-    graph = nx.compose_all([statement.to_graph()[1] for statement in statements])
-    for node in list(graph.nodes):
-        try:
-            variable = graph.nodes[node]['variable']
-            nx.contracted_nodes(graph, node, variable, copy=False)
-        except KeyError:
-            pass
+    with profiling.phase('graph') as counts:
+        graph = new_graph()
+        # the numbers of the files and the anchors are kept with the graph for later updates
+        files = {}
+        prefixes = statement_prefixes(statements, files)
+        anchors = statement_anchors(statements, prefixes)
+        graph.graph['files'] = files
+        graph.graph['anchors'] = anchors
+        for statement, prefix in zip(statements, prefixes):
+            add_statement(graph, statement, anchors, prefix)
+        counts['statements'] = len(statements)
+        counts['nodes'] = graph.number_of_nodes()
+        counts['edges'] = graph.number_of_edges()
     return graph
 
 
-def extract_from_statements(statements: List[PKLX], variable: str, done: List[str] = None) -> List[PKLX]:
-    extracted_statements = []
-    statement_variables = []
-    if done is None:
-        done = []
-    if variable in done:
-        return []
-
+def statement_prefixes(statements: List[PKLX], files: Dict[str, int] = None) -> List[str]:
+    # operator nodes are identified by the number of the file of their statement, the index of the statement within
+    # that file and their position within the statement; files are numbered in the order they first appear, files
+    # missing in the given numbers are added to them
+    if files is None:
+        files = {}
+    counts = {}
+    prefixes = []
     for statement in statements:
-        if statement.contains(variable):
-            extracted_statements.append(statement)
-        if type(statement) == Statement:
-            statement_variables.append(statement.variable.name)
-    done.append(variable)
-    for statement_variable in statement_variables:
-        if statement_variable not in done:
-            extracted_statements.extend(extract_from_statements(statements, statement_variable, done))
-    extracted_statements = list(set(extracted_statements))
+        file_name = statement.source[0] if statement.source is not None else ''
+        if file_name not in files:
+            files[file_name] = len(files)
+        counts[file_name] = counts.get(file_name, -1) + 1
+        prefixes.append(f'{files[file_name]}#{counts[file_name]}')
+    return prefixes
+
+
+def statement_anchors(statements: List[PKLX], prefixes: List[str]) -> Dict[str, str]:
+    # a named statement is represented by its anchor, variables referring to the statement are connected to it
+    # directly (the first statement with a name wins)
+    anchors = {}
+    for statement, prefix in zip(statements, prefixes):
+        if type(statement) == Statement and statement.variable.name not in anchors:
+            anchors[statement.variable.name] = next(node_ids(prefix))
+    return anchors
+
+
+def update_graph(graph: nx.DiGraph, old_statements: Dict[str, PKLX], new_statements: Dict[str, PKLX], anchors: Dict[str, str]) -> Set[str]:
+    # replaces the old statements (by prefix, added with the current anchors of the graph) by the new statements (added
+    # with the given anchors) and returns all nodes whose neighborhood or attributes changed, every edge belongs to the
+    # statement of the operator it was added for, so statements can be compared edge by edge
+    old_nodes, old_edges = statement_parts(old_statements, graph.graph['anchors'])
+    new_nodes, new_edges = statement_parts(new_statements, anchors)
+    removed_edges = old_edges - new_edges
+    added_edges = new_edges - old_edges
+    affected = set(node for edge in removed_edges for node in edge)
+    affected.update(node for edge in added_edges for node in edge)
+    graph.remove_edges_from(removed_edges)
+    for node in old_nodes.keys() - new_nodes.keys():
+        # variables might still be mentioned by other statements
+        if old_nodes[node]['node_type'] != 'variable':
+            graph.remove_node(node)
+            affected.add(node)
+    for node, attributes in new_nodes.items():
+        if node not in graph:
+            graph.add_node(node, **attributes)
+            affected.add(node)
+        elif graph.nodes[node] != attributes:
+            graph.nodes[node].clear()
+            graph.nodes[node].update(attributes)
+            affected.add(node)
+    graph.add_edges_from(added_edges)
+    # variables only mentioned by removed statements disappear with them
+    for node in affected:
+        if node in graph and graph.degree(node) == 0:
+            graph.remove_node(node)
+    graph.graph['anchors'] = anchors
+    return affected
+
+
+def statement_parts(statements: Dict[str, PKLX], anchors: Dict[str, str]) -> Tuple[Dict[str, dict], Set[Tuple[str, str]]]:
+    # the operator and variable nodes (with their attributes) and the edges the statements add to a graph
+    subgraph = new_graph()
+    for prefix, statement in statements.items():
+        add_statement(subgraph, statement, anchors, prefix)
+    # anchors of other statements are part of the subgraph but without attributes
+    nodes = {node: attributes for node, attributes in subgraph.nodes(data=True) if attributes}
+    return nodes, set(subgraph.edges)
+
+
+def extract_from_statements(statements: List[PKLX], variable: str, index: VariableIndex = None) -> List[PKLX]:
+    with profiling.phase('extract') as counts:
+        if index is None:
+            index = VariableIndex(statements)
+        extracted_statements = index.extract(variable)
+        counts['statements'] = len(extracted_statements)
     return extracted_statements
@@ -0,0 +1,143 @@
+import heapq
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from itertools import count
+from typing import Callable, Dict, List
+
+
+# the active profiler, instrumented code only checks this while profiling is disabled
+PROFILER = None
+
+
+class Phase():
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.calls = 0
+        # e.g. the number of statements, tokens or nodes handled in the phase
+        self.counts = {}
+        # None if the memory was not measured in any call
+        self.peak_memory = None
+
+
+class Profiler():
+
+    def __init__(self, memory: bool = True, top: int = 10):
+        self.memory = memory
+        self.top = top
+        self.phases: Dict[str, Phase] = {}
+        # the slowest items (files, statements, requests) of every kind as min-heaps of size top
+        self.slowest: Dict[str, list] = {}
+        self.subscribers: List[Callable[[str, str, float, dict], None]] = []
+        # tracemalloc only knows one peak for the whole process, so the memory is only measured in the thread that
+        # enabled the profiler; phases of other threads (e.g. requests of the threaded server) are only timed
+        self.thread = threading.get_ident()
+        # the open phases of every thread
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.order = count()
+
+    @contextmanager
+    def phase(self, name: str, **counts):
+        # the yielded dict takes counts that are only known at the end of the phase
+        memory = self.memory and threading.get_ident() == self.thread
+        if memory:
+            # peak memory of the open phases, nested phases pass theirs on
+            peaks = getattr(self.local, 'peaks', None)
+            if peaks is None:
+                peaks = self.local.peaks = []
+            peak = tracemalloc.get_traced_memory()[1]
+            if peaks:
+                peaks[-1] = max(peaks[-1], peak)
+            # before Python 3.9 the peak can not be reset, phases then report the peak since tracing started
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            peaks.append(0)
+        start = time.perf_counter()
+        try:
+            yield counts
+        finally:
+            seconds = time.perf_counter() - start
+            peak = None
+            if memory:
+                peak = max(peaks.pop(), tracemalloc.get_traced_memory()[1])
+                if peaks:
+                    peaks[-1] = max(peaks[-1], peak)
+            self.add(name, seconds, peak, **counts)
+
+    def add(self, name: str, seconds: float, peak_memory: int = None, **counts):
+        with self.lock:
+            phase = self.phases.get(name)
+            if phase is None:
+                phase = self.phases[name] = Phase()
+            phase.seconds += seconds
+            phase.calls += 1
+            if peak_memory is not None:
+                phase.peak_memory = max(phase.peak_memory or 0, peak_memory)
+            for key, value in counts.items():
+                phase.counts[key] = phase.counts.get(key, 0) + value
+        self.notify('phase', name, seconds, counts)
+
+    def record(self, kind: str, name: str, seconds: float, **counts):
+        with self.lock:
+            heap = self.slowest.setdefault(kind, [])
+            item = (seconds, next(self.order), name, counts)
+            if len(heap) < self.top:
+                heapq.heappush(heap, item)
+            else:
+                heapq.heappushpop(heap, item)
+        self.notify(kind, name, seconds, counts)
+
+    def subscribe(self, callback: Callable[[str, str, float, dict], None]):
+        # the callback receives the kind ('phase', 'file', 'statement', 'request'), the name, the seconds and the counts
+        self.subscribers.append(callback)
+
+    def notify(self, kind: str, name: str, seconds: float, counts: dict):
+        for callback in self.subscribers:
+            callback(kind, name, seconds, counts)
+
+    def report(self) -> str:
+        lines = [f'{"phase":<20} {"calls":>8} {"seconds":>10} {"peak MB":>8}  counts']
+        for name, phase in self.phases.items():
+            counts = ' '.join(f'{key}={value}' for key, value in phase.counts.items())
+            peak = f'{phase.peak_memory / 2 ** 20:8.1f}' if phase.peak_memory is not None else f'{"-":>8}'
+            lines.append(f'{name:<20} {phase.calls:>8} {phase.seconds:10.3f} {peak}  {counts}')
+        for kind, heap in self.slowest.items():
+            lines.append('')
+            lines.append(f'slowest {kind}s')
+            for seconds, _, name, counts in sorted(heap, reverse=True):
+                counts = ' '.join(f'{key}={value}' for key, value in counts.items())
+                lines.append(f'{seconds:10.4f}s  {name}  {counts}')
+        return '\n'.join(lines)
+
+
+def enable(memory: bool = True, top: int = 10) -> Profiler:
+    global PROFILER
+    PROFILER = Profiler(memory, top)
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    return PROFILER
+
+
+def disable() -> Profiler:
+    global PROFILER
+    profiler = PROFILER
+    PROFILER = None
+    if profiler is not None and profiler.memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    return profiler
+
+
+def subscribe(callback: Callable[[str, str, float, dict], None]) -> Profiler:
+    # enables timing (without memory tracking) if profiling is disabled
+    profiler = PROFILER if PROFILER is not None else enable(memory=False)
+    profiler.subscribe(callback)
+    return profiler
+
+
+def phase(name: str, **counts):
+    if PROFILER is None:
+        return nullcontext({})
+    return PROFILER.phase(name, **counts)
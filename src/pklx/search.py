@@ -0,0 +1,104 @@
+import bisect
+from array import array
+from typing import Iterable, List, Tuple
+
+
+# sorts after every character, key + LAST ends the range of keys starting with key
+LAST = '\U0010ffff'
+
+
+def trigrams(key: str) -> set:
+    return {key[i:i + 3] for i in range(len(key) - 2)}
+
+
+class SearchIndex():
+    # Case insensitive prefix and substring search over variable names. Prefix matches come from a sorted array of
+    # keys (bisect), substring matches from a trigram index. Names get a stable id so that they can be added and
+    # removed while the viewer is running.
+
+    def __init__(self, names: Iterable[str] = ()):
+        # id -> name and its key, None once the name was removed
+        self.names = []
+        self.folded = []
+        self.ids = {}
+        # trigram -> ids of all names containing it
+        self.grams = {}
+        entries = []
+        for name in names:
+            if name not in self.ids:
+                entries.append((self.register(name), self.ids[name]))
+        entries.sort()
+        # sorted keys and the ids belonging to them
+        self.keys = [key for key, _ in entries]
+        self.key_ids = [name_id for _, name_id in entries]
+
+    def register(self, name: str) -> str:
+        key = name.casefold()
+        name_id = len(self.names)
+        self.names.append(name)
+        self.folded.append(key)
+        self.ids[name] = name_id
+        for gram in trigrams(key):
+            postings = self.grams.get(gram)
+            if postings is None:
+                postings = self.grams[gram] = array('I')
+            postings.append(name_id)
+        return key
+
+    def add(self, name: str):
+        name_id = self.ids.get(name)
+        if name_id is None:
+            key = self.register(name)
+            name_id = self.ids[name]
+        elif self.names[name_id] is None:
+            # the trigrams of removed names are kept, so the name only has to be restored
+            key = self.folded[name_id]
+            self.names[name_id] = name
+        else:
+            return
+        i = bisect.bisect_right(self.keys, key)
+        self.keys.insert(i, key)
+        self.key_ids.insert(i, name_id)
+
+    def remove(self, name: str):
+        name_id = self.ids.get(name)
+        if name_id is None or self.names[name_id] is None:
+            return
+        self.names[name_id] = None
+        i = bisect.bisect_left(self.keys, self.folded[name_id])
+        while self.key_ids[i] != name_id:
+            i += 1
+        del self.keys[i]
+        del self.key_ids[i]
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def search(self, query: str, limit: int = 20, offset: int = 0) -> Tuple[List[str], bool]:
+        # ranked matches (exact, then names starting with the query alphabetically, then names containing it by the
+        # position of the match and their length) and whether there are more
+        key = query.casefold()
+        wanted = offset + limit + 1
+        start = bisect.bisect_left(self.keys, key)
+        end = bisect.bisect_left(self.keys, key + LAST) if key else len(self.keys)
+        matches = self.key_ids[start:min(end, start + wanted)]
+        # substrings need at least one trigram, shorter queries only match prefixes
+        if len(matches) < wanted and len(key) >= 3:
+            postings = []
+            for gram in trigrams(key):
+                if gram not in self.grams:
+                    postings = None
+                    break
+                postings.append(self.grams[gram])
+            if postings:
+                found = []
+                for name_id in min(postings, key=len):
+                    if self.names[name_id] is None:
+                        continue
+                    position = self.folded[name_id].find(key)
+                    if position > 0:
+                        found.append((position, len(self.folded[name_id]), self.folded[name_id], name_id))
+                found.sort()
+                matches.extend(name_id for _, _, _, name_id in found[:wanted - len(matches)])
+        page = matches[offset:offset + limit]
+        return [self.names[name_id] for name_id in page], len(matches) > offset + limit
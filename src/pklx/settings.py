@@ -4,7 +4,11 @@ import json
 
 SETTINGS = {
     "FOLDER_PATH": '',
-    "DELIMITER": '-/'
+    "DELIMITER": '-/',
+    # glob patterns for the paths (relative to the data folder, with / as separator) of the files that are loaded, no
+    # INCLUDE patterns load all files
+    "INCLUDE": ['*'],
+    "EXCLUDE": []
 }
 
 
@@ -12,7 +16,8 @@ def set_settings(key: str, value: str):
     global FOLDER_PATH
     global DELIMITER
     if key in SETTINGS:
-        SETTINGS[key] = value
+        # lists are passed as comma separated values, e.g. *.md,*.txt
+        SETTINGS[key] = [item.strip() for item in value.split(',') if item.strip()] if type(SETTINGS[key]) == list else value
     else:
         raise Exception(f'Invalid key: {key}')
     with open(os.path.join(os.path.dirname(os.path.realpath(__file__)), 'settings.json'), 'w') as file:
@@ -20,4 +25,5 @@ def set_settings(key: str, value: str):
 
 
 with open(os.path.join(os.path.dirname(os.path.realpath(__file__)), 'settings.json'), 'r') as file:
-    SETTINGS = json.load(file)
+    # settings files written by older versions lack the newer keys
+    SETTINGS.update(json.load(file))
@@ -0,0 +1,114 @@
+import os
+import pickle
+from typing import Dict, List, Tuple
+from .cache import cache_folder, load_pickle
+from .index import VariableIndex
+from .objects import PKLX
+from .parser import list_files, load, statements_to_graph
+from .settings import SETTINGS
+from . import profiling
+from .utils import undirected_adjacency
+
+
+SNAPSHOT_FILE = 'snapshot'
+SNAPSHOT_VERSION = 5
+
+
+class Snapshot():
+
+    def __init__(self, relations: List[str], statements: List[PKLX] = None, index: VariableIndex = None, graph=None, nodes=None, adjacency=None):
+        self.relations = relations
+        self.statements = statements
+        self.index = index
+        self.graph = graph
+        # names of all variable nodes
+        self.nodes = nodes
+        self.adjacency = adjacency
+        self.statement_count = len(statements) if statements is not None else 0
+        # whether the snapshot was read from disk instead of being rebuilt
+        self.fresh = False
+
+
+def fingerprint(folder_path: str, files: Dict[str, Tuple[int, int]] = None) -> list:
+    # a snapshot is fresh as long as no file was added, removed or modified, files are the modification times and sizes
+    # of the files of the data folder if they are already known (e.g. from a FolderWatcher)
+    if files is None:
+        files = {}
+        for file_name in list_files(folder_path):
+            stat = os.stat(file_name)
+            files[file_name] = (stat.st_mtime_ns, stat.st_size)
+    files = [(os.path.relpath(file_name, folder_path), mtime, size) for file_name, (mtime, size) in files.items()]
+    return [SNAPSHOT_VERSION, SETTINGS['DELIMITER'], sorted(files)]
+
+
+def read_snapshot(folder_path: str, file_fingerprint: list, with_statements: bool = True, with_graph: bool = True) -> Snapshot:
+    # the file holds a header followed by independent sections, only the requested sections are unpickled
+    try:
+        # like the parse cache the snapshot is a pickle and kept in a folder of the user
+        with open(os.path.join(cache_folder(folder_path), SNAPSHOT_FILE), 'rb') as file:
+            header = load_pickle(file)
+            if header['fingerprint'] != file_fingerprint or (with_graph and 'graph' not in header['sections']):
+                return None
+            start = file.tell()
+            snapshot = Snapshot(header['relations'])
+            snapshot.statement_count = header['statement_count']
+            if with_statements:
+                file.seek(start + header['sections']['statements'])
+                snapshot.statements, snapshot.index = load_pickle(file)
+            if with_graph:
+                file.seek(start + header['sections']['graph'])
+                snapshot.graph, snapshot.nodes, snapshot.adjacency = load_pickle(file)
+    except FileNotFoundError:
+        return None
+    except Exception:
+        # outdated or broken snapshots are simply rebuilt
+        return None
+    snapshot.fresh = True
+    return snapshot
+
+
+def write_snapshot(folder_path: str, file_fingerprint: list, snapshot: Snapshot):
+    sections = {}
+    data = [pickle.dumps((snapshot.statements, snapshot.index), protocol=pickle.HIGHEST_PROTOCOL)]
+    sections['statements'] = 0
+    if snapshot.graph is not None:
+        data.append(pickle.dumps((snapshot.graph, snapshot.nodes, snapshot.adjacency), protocol=pickle.HIGHEST_PROTOCOL))
+        sections['graph'] = len(data[0])
+    header = {
+        'fingerprint': file_fingerprint,
+        'relations': snapshot.relations,
+        'statement_count': snapshot.statement_count,
+        'sections': sections
+    }
+    path = os.path.join(cache_folder(folder_path), SNAPSHOT_FILE)
+    try:
+        with open(path + '.tmp', 'wb') as file:
+            pickle.dump(header, file, protocol=pickle.HIGHEST_PROTOCOL)
+            for section in data:
+                file.write(section)
+        os.replace(path + '.tmp', path)
+    except OSError:
+        # the snapshot is optional, e.g. the data folder might be read-only
+        pass
+
+
+def load_snapshot(folder_path: str, with_statements: bool = True, with_graph: bool = True, use_cache: bool = True, cache_stats: Dict[str, int] = None, workers: int = 1, files: Dict[str, Tuple[int, int]] = None) -> Snapshot:
+    use_snapshot = use_cache and os.path.isdir(folder_path)
+    if use_snapshot:
+        with profiling.phase('snapshot read'):
+            file_fingerprint = fingerprint(folder_path, files)
+            snapshot = read_snapshot(folder_path, file_fingerprint, with_statements, with_graph)
+        if snapshot is not None:
+            return snapshot
+    relations, statements = load(folder_path, use_cache=use_cache, cache_stats=cache_stats, workers=workers)
+    with profiling.phase('index', statements=len(statements)):
+        snapshot = Snapshot(relations, statements, VariableIndex(statements))
+    if with_graph:
+        snapshot.graph = statements_to_graph(statements)
+        with profiling.phase('adjacency'):
+            snapshot.nodes = [node for node in snapshot.graph.nodes if snapshot.graph.nodes[node]['node_type'] == 'variable']
+            snapshot.adjacency = undirected_adjacency(snapshot.graph)
+    if use_snapshot:
+        with profiling.phase('snapshot write'):
+            write_snapshot(folder_path, file_fingerprint, snapshot)
+    return snapshot
@@ -0,0 +1,367 @@
+from __future__ import annotations
+import json
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple, TYPE_CHECKING
+from .cache import digest
+from .objects import PKLX, GraphParts, Statement, new_graph, node_ids
+from .parser import RelationMatcher, compile_relations, list_files, load_files, load_relations, parse_statement
+from .search import LAST
+from .settings import SETTINGS
+from . import profiling
+
+if TYPE_CHECKING:
+    import networkx as nx
+
+
+STORE_FILE = '.pklx-store'
+# version of the schema, kept as the user_version of the database
+STORE_VERSION = 3
+
+# Statements are stored with their text as written in the file, which is parsed again when they are extracted, and as
+# printed after parsing. The graph consists of nodes (variables
+# and operators) and edges between them. Edges are stored as the statements of every file add them to a graph without
+# anchors, so a variable naming a statement is kept as a variable and the queries replace it with the anchor of its
+# statement. Anchors can change when another file changes, this way the edges of a file only depend on the file itself
+# and every edge has an operator of its file at one end.
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS relations (id INTEGER PRIMARY KEY, name TEXT UNIQUE);
+CREATE TABLE IF NOT EXISTS files (id INTEGER PRIMARY KEY, name TEXT UNIQUE, position INTEGER, mtime INTEGER, size INTEGER, hash TEXT);
+CREATE TABLE IF NOT EXISTS statements (id INTEGER PRIMARY KEY, file INTEGER, position INTEGER, line INTEGER, text TEXT, formatted TEXT, name INTEGER, anchor INTEGER);
+CREATE TABLE IF NOT EXISTS nodes (id INTEGER PRIMARY KEY, name TEXT UNIQUE, key TEXT, node_type TEXT, relation INTEGER, variable TEXT, file INTEGER);
+CREATE TABLE IF NOT EXISTS edges (source INTEGER, destination INTEGER);
+CREATE TABLE IF NOT EXISTS mentions (variable INTEGER, statement INTEGER, position INTEGER, PRIMARY KEY (variable, statement)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS anchors (variable INTEGER PRIMARY KEY, anchor INTEGER);
+'''
+
+# indexes of the queries, they are created after the rows when a store is built from scratch
+INDEXES = {
+    'statements_file': 'statements (file)',
+    'statements_name': 'statements (name) WHERE name IS NOT NULL',
+    'nodes_key': 'nodes (key) WHERE key IS NOT NULL',
+    'nodes_file': 'nodes (file) WHERE file IS NOT NULL',
+    'edges_source': 'edges (source)',
+    'edges_destination': 'edges (destination)',
+    'mentions_statement': 'mentions (statement)',
+    'anchors_anchor': 'anchors (anchor)'
+}
+
+# position of a statement in the corpus, statements (s) are ordered by the load order of their files (f)
+CORPUS_ORDER = 'f.position * 4294967296 + s.position'
+
+# variables (only they have a key) are nodes of the graph if they are used in an edge and do not name a statement
+GRAPH_VARIABLE = '''(NOT EXISTS (SELECT 1 FROM anchors WHERE variable = nodes.id)
+    AND (EXISTS (SELECT 1 FROM edges WHERE source = nodes.id) OR EXISTS (SELECT 1 FROM edges WHERE destination = nodes.id)))'''
+GRAPH_NODE = f'(nodes.key IS NULL OR {GRAPH_VARIABLE})'
+
+# neighbors of nodes given by id, variables naming a statement are replaced with its anchor
+OUT_NEIGHBORS = '''SELECT DISTINCT n.name, n.node_type FROM edges e LEFT JOIN anchors a ON a.variable = e.destination
+    JOIN nodes n ON n.id = IFNULL(a.anchor, e.destination) WHERE e.source IN ({})'''
+IN_NEIGHBORS = '''SELECT DISTINCT n.name, n.node_type FROM edges e LEFT JOIN anchors a ON a.variable = e.source
+    JOIN nodes n ON n.id = IFNULL(a.anchor, e.source) WHERE e.destination IN ({})'''
+EDGES = '''SELECT IFNULL(a.anchor, e.source), IFNULL(b.anchor, e.destination) FROM edges e
+    LEFT JOIN anchors a ON a.variable = e.source LEFT JOIN anchors b ON b.variable = e.destination WHERE e.source IN ({})'''
+
+# the statements mentioning a variable or a named statement mentioned by them, like VariableIndex.closure
+EXTRACT = '''WITH RECURSIVE names(id) AS (
+    SELECT id FROM nodes WHERE name = ?
+    UNION
+    SELECT other.variable FROM names JOIN mentions m ON m.variable = names.id JOIN mentions other ON other.statement = m.statement
+    WHERE EXISTS (SELECT 1 FROM statements WHERE name = other.variable)
+)
+SELECT s.text, s.formatted, f.name, s.line FROM statements s JOIN files f ON f.id = s.file
+WHERE s.id IN (SELECT statement FROM mentions WHERE variable IN names) ORDER BY f.position, s.position'''
+
+# largest number of parameters of one query, older SQLite versions allow 999
+CHUNK_SIZE = 500
+
+
+class Store():
+    # The statements and the knowledge graph of a data folder in an SQLite database inside it, so that collecting and
+    # viewing only keep the results of queries in memory. extract and variables work like those of VariableIndex,
+    # search like SearchIndex.search and neighbors and subgraph answer the searches of the viewer.
+
+    def __init__(self, folder_path: str):
+        if not os.path.isdir(folder_path):
+            raise Exception(f'Data folder not found: {folder_path}')
+        self.folder_path = folder_path
+        self.path = os.path.join(folder_path, STORE_FILE)
+        # one connection per thread (and process), the viewer answers requests from several threads
+        self.local = threading.local()
+        self.matcher = None
+        # the largest ids in use while add_file writes rows
+        self.next_node = 0
+        self.next_statement = 0
+        connection = self.connection
+        if connection.execute('PRAGMA user_version').fetchone()[0] != STORE_VERSION:
+            # stores written by other versions are rebuilt
+            tables = [name for name, in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+            for table in tables:
+                connection.execute(f'DROP TABLE {table}')
+            connection.execute(f'PRAGMA user_version = {STORE_VERSION}')
+        # readers are not blocked while the watcher of the viewer updates the store
+        connection.execute('PRAGMA journal_mode = WAL')
+        connection.executescript(SCHEMA)
+        self.create_indexes()
+
+    def create_indexes(self):
+        for name, definition in INDEXES.items():
+            self.connection.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {definition}')
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        local = self.local
+        if getattr(local, 'pid', None) != os.getpid():
+            # connections must not be used across a fork
+            local.connection = sqlite3.connect(self.path, timeout=60)
+            local.pid = os.getpid()
+        return local.connection
+
+    def update(self, workers: int = 1, rebuild: bool = False, cache_stats: Dict[str, int] = None):
+        # brings the store up to date with the data folder, only files that changed since the last update are parsed
+        # (in parallel if requested) and one file is in memory at a time
+        with profiling.phase('walk') as counts:
+            file_names = list_files(self.folder_path)
+            counts['files'] = len(file_names)
+        relations = load_relations(file_names)
+        file_names = [file_name for file_name in file_names if os.path.split(file_name)[-1] != '.ontology']
+        connection = self.connection
+        with connection:
+            # the statements depend on the ontology and the delimiter, a change of either rebuilds everything
+            key = json.dumps([digest('\n'.join(relations).encode()), SETTINGS['DELIMITER']])
+            row = connection.execute("SELECT value FROM meta WHERE key = 'key'").fetchone()
+            if rebuild or row is None or row[0] != key:
+                for table in ('meta', 'relations', 'files', 'statements', 'nodes', 'edges', 'mentions', 'anchors'):
+                    connection.execute(f'DELETE FROM {table}')
+                connection.executemany('INSERT INTO relations (name) VALUES (?)', ((relation,) for relation in dict.fromkeys(relations)))
+                connection.execute("INSERT INTO meta VALUES ('key', ?)", (key,))
+            self.matcher = compile_relations(relations)
+            relation_ids = dict(connection.execute('SELECT name, id FROM relations'))
+
+            with profiling.phase('cache') as counts:
+                files = {name: (file_id, mtime, size, file_hash) for name, file_id, mtime, size, file_hash in connection.execute('SELECT name, id, mtime, size, hash FROM files')}
+                positions = []
+                pending = []
+                for position, file_name in enumerate(file_names):
+                    name = os.path.relpath(file_name, self.folder_path).replace(os.sep, '/')
+                    stat = os.stat(file_name)
+                    file_id, mtime, size, file_hash = files.pop(name, (None, None, None, None))
+                    if file_id is None:
+                        file_id = connection.execute('INSERT INTO files (name, position) VALUES (?, ?)', (name, position)).lastrowid
+                    else:
+                        positions.append((position, file_id))
+                    if (mtime, size) != (stat.st_mtime_ns, stat.st_size):
+                        pending.append((file_id, file_name, name, stat, file_hash))
+                connection.executemany('UPDATE files SET position = ? WHERE id = ?', positions)
+                counts['hits'] = len(file_names) - len(pending)
+
+            with profiling.phase('load files', files=len(pending)):
+                # building the indexes at once is a lot faster than updating them with every row
+                fresh = not positions and not files
+                if fresh:
+                    for index in INDEXES:
+                        connection.execute(f'DROP INDEX IF EXISTS {index}')
+                # variables whose statements were removed, they are deleted if no other statement mentions them
+                removed = set()
+                for name, (file_id, _, _, _) in files.items():
+                    removed.update(self.remove_file(file_id))
+                    connection.execute('DELETE FROM files WHERE id = ?', (file_id,))
+                parsed_files = 0
+                self.next_node = connection.execute('SELECT IFNULL(MAX(id), 0) FROM nodes').fetchone()[0]
+                self.next_statement = connection.execute('SELECT IFNULL(MAX(id), 0) FROM statements').fetchone()[0]
+                results = load_files([file_name for _, file_name, _, _, _ in pending], [name for _, _, name, _, _ in pending],
+                                     [file_hash for _, _, _, _, file_hash in pending], self.matcher, workers)
+                for (file_id, _, name, stat, file_hash), (content_hash, statements, parsed_statements) in zip(pending, results):
+                    if parsed_statements is not None:
+                        # the file was not only touched, files without a hash are new
+                        if file_hash is not None:
+                            removed.update(self.remove_file(file_id))
+                        self.add_file(file_id, statements, parsed_statements, relation_ids)
+                        parsed_files += 1
+                    connection.execute('UPDATE files SET mtime = ?, size = ?, hash = ? WHERE id = ?', (stat.st_mtime_ns, stat.st_size, content_hash, file_id))
+                connection.executemany('DELETE FROM nodes WHERE id = ? AND NOT EXISTS (SELECT 1 FROM mentions WHERE variable = ?)', ((variable, variable) for variable in removed))
+                if fresh:
+                    self.create_indexes()
+
+            with profiling.phase('anchors'):
+                # the first statement with a name in corpus order is its anchor
+                connection.execute('DELETE FROM anchors')
+                connection.execute(f'''INSERT INTO anchors SELECT name, anchor FROM (SELECT s.name, s.anchor, MIN({CORPUS_ORDER})
+                    FROM statements s JOIN files f ON f.id = s.file WHERE s.name IS NOT NULL GROUP BY s.name)''')
+        if cache_stats is not None:
+            cache_stats['hits'] = len(file_names) - parsed_files
+            cache_stats['misses'] = parsed_files
+
+    def remove_file(self, file_id: int) -> Set[int]:
+        # removes the statements and graph parts of a file and returns the variables they mentioned
+        connection = self.connection
+        variables = set(variable for variable, in connection.execute('SELECT DISTINCT m.variable FROM mentions m JOIN statements s ON s.id = m.statement WHERE s.file = ?', (file_id,)))
+        connection.execute('DELETE FROM mentions WHERE statement IN (SELECT id FROM statements WHERE file = ?)', (file_id,))
+        connection.execute('DELETE FROM statements WHERE file = ?', (file_id,))
+        connection.execute('DELETE FROM edges WHERE source IN (SELECT id FROM nodes WHERE file = ?)', (file_id,))
+        connection.execute('DELETE FROM edges WHERE destination IN (SELECT id FROM nodes WHERE file = ?)', (file_id,))
+        connection.execute('DELETE FROM nodes WHERE file = ?', (file_id,))
+        return variables
+
+    def add_file(self, file_id: int, statements: List[str], parsed_statements: List[PKLX], relation_ids: Dict[str, int]):
+        # the rows of a file are written with one query per table, their ids are assigned here
+        connection = self.connection
+        parts = GraphParts()
+        # operators are numbered by the id of their file like statement_prefixes numbers them by the file number
+        prefixes = [f'{file_id}#{i}' for i in range(len(parsed_statements))]
+        for parsed_statement, prefix in zip(parsed_statements, prefixes):
+            parsed_statement.add_to_graph(parts, {}, node_ids(prefix))
+        mentions = [dict.fromkeys(parsed_statement.variables()) for parsed_statement in parsed_statements]
+        variables = list(dict.fromkeys(variable for statement_variables in mentions for variable in statement_variables))
+        ids = {}
+        for chunk in chunks(variables):
+            ids.update(connection.execute(f'SELECT name, id FROM nodes WHERE name IN ({", ".join("?" * len(chunk))})', chunk))
+        rows = []
+        for variable in variables:
+            if variable not in ids:
+                ids[variable] = self.next_node = self.next_node + 1
+                rows.append((ids[variable], variable, variable.casefold(), 'variable', None, None, None))
+        for node, attributes in parts.nodes.items():
+            if attributes['node_type'] != 'variable':
+                ids[node] = self.next_node = self.next_node + 1
+                rows.append((ids[node], node, None, attributes['node_type'], relation_ids[attributes['label']], attributes.get('variable'), file_id))
+        connection.executemany('INSERT INTO nodes VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+        connection.executemany('INSERT INTO edges VALUES (?, ?)', ((ids[source], ids[destination]) for source, destination in parts.edges))
+        rows = []
+        mention_rows = []
+        for i, (statement, parsed_statement, prefix, statement_variables) in enumerate(zip(statements, parsed_statements, prefixes, mentions)):
+            self.next_statement += 1
+            statement_name = ids[parsed_statement.variable.name] if type(parsed_statement) == Statement else None
+            rows.append((self.next_statement, file_id, i, parsed_statement.source[1], statement, str(parsed_statement), statement_name, ids[next(node_ids(prefix))]))
+            mention_rows.extend((ids[variable], self.next_statement, j) for j, variable in enumerate(statement_variables))
+        connection.executemany('INSERT INTO statements VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        connection.executemany('INSERT INTO mentions VALUES (?, ?, ?)', mention_rows)
+
+    def relations(self) -> List[str]:
+        return [name for name, in self.connection.execute('SELECT name FROM relations ORDER BY id')]
+
+    def relation_matcher(self) -> RelationMatcher:
+        if self.matcher is None:
+            self.matcher = compile_relations(self.relations())
+        return self.matcher
+
+    @property
+    def statement_count(self) -> int:
+        return self.connection.execute('SELECT COUNT(*) FROM statements').fetchone()[0]
+
+    def variables(self) -> Iterator[str]:
+        # all variables in the order they are first mentioned, within a statement in the order they appear
+        query = '''SELECT n.name FROM mentions m JOIN statements s ON s.id = m.statement JOIN files f ON f.id = s.file
+            JOIN nodes n ON n.id = m.variable ORDER BY f.position, s.position, m.position'''
+        seen = set()
+        for name, in self.connection.execute(query):
+            if name not in seen:
+                seen.add(name)
+                yield name
+
+    def extract(self, variable: str) -> List[PKLX]:
+        statements = []
+        for text, _, file_name, line in self.connection.execute(EXTRACT, (variable,)).fetchall():
+            statement = parse_statement(self.relation_matcher(), text)
+            statement.source = (file_name, line)
+            statements.append(statement)
+        return statements
+
+    def extract_formatted(self, variable: str) -> List[dict]:
+        # daemon.format_statement of the extracted statements without parsing them again
+        return [{'statement': formatted, 'file': file_name, 'line': line} for _, formatted, file_name, line in self.connection.execute(EXTRACT, (variable,))]
+
+    def search(self, query: str, limit: int = 20, offset: int = 0) -> Tuple[List[str], bool]:
+        # the ranking of SearchIndex.search, prefix matches come from the index of the keys and substring matches from
+        # a scan of all keys
+        key = query.casefold()
+        wanted = offset + limit + 1
+        connection = self.connection
+        names = [name for name, in connection.execute(f'SELECT name FROM nodes WHERE key >= ? AND key < ? AND {GRAPH_VARIABLE} ORDER BY key LIMIT ?', (key, key + LAST, wanted))]
+        if len(names) < wanted and len(key) >= 3:
+            query = f'SELECT name FROM nodes WHERE key IS NOT NULL AND instr(key, ?) > 1 AND {GRAPH_VARIABLE} ORDER BY instr(key, ?), length(key), key LIMIT ?'
+            names.extend(name for name, in connection.execute(query, (key, key, wanted - len(names))))
+        return names[offset:offset + limit], len(names) > offset + limit
+
+    def variable_nodes(self) -> Iterator[str]:
+        for name, in self.connection.execute(f'SELECT name FROM nodes WHERE key IS NOT NULL AND {GRAPH_VARIABLE} ORDER BY id'):
+            yield name
+
+    def __contains__(self, node: str) -> bool:
+        return self.connection.execute(f'SELECT 1 FROM nodes WHERE name = ? AND {GRAPH_NODE}', (node,)).fetchone() is not None
+
+    def neighbors(self, node: str, direction: str = 'both') -> Optional[List[Tuple[str, str]]]:
+        # names and types of the neighbors of a node of the graph, None if there is no such node
+        connection = self.connection
+        row = connection.execute(f'SELECT id FROM nodes WHERE name = ? AND {GRAPH_NODE}', (node,)).fetchone()
+        if row is None:
+            return None
+        # the anchor of a statement also stands for the variables naming it
+        keys = [row[0]] + [variable for variable, in connection.execute('SELECT variable FROM anchors WHERE anchor = ?', row)]
+        marks = ', '.join('?' * len(keys))
+        if direction == 'out':
+            queries = [OUT_NEIGHBORS.format(marks)]
+        elif direction == 'in':
+            queries = [IN_NEIGHBORS.format(marks)]
+        elif direction == 'both':
+            queries = [OUT_NEIGHBORS.format(marks), IN_NEIGHBORS.format(marks)]
+        else:
+            raise Exception(f'Invalid direction: {direction}, use in, out or both')
+        return connection.execute(' UNION '.join(queries), keys * len(queries)).fetchall()
+
+    def adjacency(self, direction: str = 'both') -> 'StoreAdjacency':
+        return StoreAdjacency(self, direction)
+
+    def subgraph(self, nodes: Iterable[str]) -> nx.DiGraph:
+        # the nodes with their attributes and the edges between them, like graph.subgraph(nodes) of the whole graph
+        connection = self.connection
+        nodes = list(nodes)
+        attributes = {}
+        names = {}
+        for chunk in chunks(nodes):
+            query = f'''SELECT n.id, n.name, n.node_type, r.name, n.variable, f.name FROM nodes n LEFT JOIN relations r ON r.id = n.relation
+                LEFT JOIN files f ON f.id = n.file WHERE n.name IN ({", ".join("?" * len(chunk))})'''
+            for node_id, name, node_type, label, variable, file_name in connection.execute(query, chunk):
+                names[node_id] = name
+                attributes[name] = {'node_type': node_type}
+                if label is not None:
+                    attributes[name]['label'] = label
+                if variable is not None:
+                    attributes[name]['variable'] = variable
+                if file_name is not None:
+                    attributes[name]['file'] = file_name
+        graph = new_graph()
+        for node in nodes:
+            graph.add_node(node, **attributes[node])
+        keys = list(names)
+        for chunk in chunks(list(names)):
+            keys.extend(variable for variable, in connection.execute(f'SELECT variable FROM anchors WHERE anchor IN ({", ".join("?" * len(chunk))})', chunk))
+        for chunk in chunks(keys):
+            for source, destination in connection.execute(EDGES.format(', '.join('?' * len(chunk))), chunk):
+                if source in names and destination in names:
+                    graph.add_edge(names[source], names[destination])
+        return graph
+
+
+class StoreAdjacency():
+    # the neighbors of the nodes in a store like the adjacency of a graph, queried when they are needed; the types of
+    # the returned nodes are kept for the stop condition of a search
+
+    def __init__(self, store: Store, direction: str = 'both'):
+        self.store = store
+        self.direction = direction
+        self.node_types = {}
+
+    def __getitem__(self, node: str) -> List[str]:
+        neighbors = self.store.neighbors(node, self.direction)
+        if neighbors is None:
+            raise KeyError(node)
+        self.node_types.update(neighbors)
+        return [neighbor for neighbor, _ in neighbors]
+
+
+def chunks(items: list, size: int = CHUNK_SIZE) -> Iterator[list]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
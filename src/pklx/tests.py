@@ -1,8 +1,59 @@
-from pklx.parser import load, extract_from_statements
+import os
+import tempfile
+from pklx.parser import list_files, load, extract_from_statements, statements_to_graph
 from pklx.settings import SETTINGS
 
+
+def check_update_graph():
+    # the graph updated after an edit has to be the graph a fresh load builds, also if the edit moves the anchor of a
+    # named statement to a file that is loaded earlier
+    from pklx.visx import backend
+    folder_path = SETTINGS['FOLDER_PATH']
+    with tempfile.TemporaryDirectory() as temporary_folder:
+        with open(os.path.join(temporary_folder, '.ontology'), 'w') as file:
+            file.write('IS -/ A relation\n')
+        for i in range(5):
+            with open(os.path.join(temporary_folder, f'note{i}.md'), 'w') as file:
+                file.write(f'-/ A{i} IS B{i} -/\n-/ C{i} IS Named -/\n')
+        file_names = [file_name for file_name in list_files(temporary_folder) if not file_name.endswith('.ontology')]
+        with open(file_names[-1], 'a') as file:
+            file.write('-/ Named = D IS E -/\n')
+        try:
+            SETTINGS['FOLDER_PATH'] = temporary_folder
+            backend.RELATIONS, statements = load(temporary_folder, use_cache=False)
+            backend.FILES = backend.statements_to_files(statements)
+            backend.set_graph(statements_to_graph(statements))
+            with open(file_names[0], 'a') as file:
+                file.write('-/ Named = F IS G -/\n')
+            backend.update([file_names[0]])
+            _, statements = load(temporary_folder, use_cache=False)
+            graph = statements_to_graph(statements)
+        finally:
+            SETTINGS['FOLDER_PATH'] = folder_path
+        assert dict(backend.GRAPH.nodes(data=True)) == dict(graph.nodes(data=True)), 'updated graph has different nodes'
+        assert set(backend.GRAPH.edges) == set(graph.edges), 'updated graph has different edges'
+        assert backend.GRAPH.graph['anchors'] == graph.graph['anchors'], 'updated graph has different anchors'
+
+
+def check_ntriples_self_reference():
+    # the operands of an operator come from the statement, in A = A IS B the anchor is its own subject
+    from pklx.export import BASE, RDF, graph_parts, node_iri, ntriples_lines
+    with tempfile.TemporaryDirectory() as temporary_folder:
+        with open(os.path.join(temporary_folder, '.ontology'), 'w') as file:
+            file.write('IS -/ A relation\n')
+        with open(os.path.join(temporary_folder, 'note.md'), 'w') as file:
+            file.write('-/ A = A IS B -/\n-/ C IS D -/\n')
+        lines = list(ntriples_lines(graph_parts(temporary_folder)))
+    anchor = node_iri(BASE, '0#0.0')
+    assert f'{anchor} <{RDF}subject> {anchor} .\n' in lines, 'wrong subject of a self-referencing statement'
+    assert f'{anchor} <{RDF}object> {node_iri(BASE, "B")} .\n' in lines, 'wrong object of a self-referencing statement'
+    assert f'{node_iri(BASE, "C")} <{BASE}relation/IS> {node_iri(BASE, "D")} .\n' in lines, 'missing plain triple'
+
+
 if __name__ == '__main__':
     relations, statements = load(SETTINGS['FOLDER_PATH'])
     extracted_statements = extract_from_statements(statements, 'B')
     for statement in extracted_statements:
         print(statement)
+    check_update_graph()
+    check_ntriples_self_reference()
@@ -1,19 +1,145 @@
-import networkx as nx
-from collections import deque
-from typing import Callable
+from __future__ import annotations
+from collections import deque, OrderedDict
+from threading import Lock
+from typing import Callable, Dict, Hashable, Iterable, List, Mapping, Optional, Tuple, TYPE_CHECKING
 
+if TYPE_CHECKING:
+    import networkx as nx
 
-def bfs(graph: nx.Graph, source: str, stop_condition: Callable = None) -> nx.Graph:
-    visited = set([source])
+
+def undirected_adjacency(graph: nx.DiGraph) -> Dict[str, List[str]]:
+    # neighbors of every node ignoring the edge direction, computed once instead of graph.to_undirected() per search
+    return {node: list(set(graph.successors(node)).union(graph.predecessors(node))) for node in graph.nodes}
+
+
+def neighbors(graph: nx.DiGraph, direction: str = 'both', adjacency: Dict[str, List[str]] = None) -> Mapping[str, Iterable[str]]:
+    if direction == 'out':
+        return graph.succ
+    if direction == 'in':
+        return graph.pred
+    if direction == 'both':
+        return adjacency if adjacency is not None else undirected_adjacency(graph)
+    raise Exception(f'Invalid direction: {direction}, use in, out or both')
+
+
+def bfs(graph: nx.DiGraph, source: str, stop_condition: Callable = None, adjacency: Dict[str, List[str]] = None,
+        depth: int = None, max_nodes: int = None, max_edges: int = None, direction: str = 'both') -> Tuple[nx.Graph, bool]:
+    # Expands the source and every reached node for which stop_condition is false, at most depth hops away from the
+    # source and only along edges in the given direction. Returns the subgraph of the reached nodes and whether the
+    # search stopped early because it reached max_nodes nodes or max_edges edges of the expanded nodes.
+    hops, truncated = breadth_first(source, neighbors(graph, direction, adjacency), stop_condition, depth, max_nodes, max_edges)
+    return graph.subgraph(hops), truncated
+
+
+def breadth_first(source: str, adjacency: Mapping[str, Iterable[str]], stop_condition: Callable = None, depth: int = None,
+                  max_nodes: int = None, max_edges: int = None) -> Tuple[Dict[str, int], bool]:
+    # the search of bfs on any adjacency, returns the hops of every reached node and whether the search stopped early
     if stop_condition is None:
         stop_condition = lambda node: False
-    undirected_graph = graph.to_undirected()
-    neighbors = undirected_graph.neighbors(source)
-    queue = deque([neighbor for neighbor in neighbors])
-    while queue:
-        node = queue.pop()
-        visited.add(node)
-        if not stop_condition(node):
-            neighbors = undirected_graph.neighbors(node)
-            queue.extendleft([neighbor for neighbor in neighbors if neighbor not in visited])
-    return graph.subgraph(visited)
+    hops = {source: 0}
+    expanded = set()
+    edges = 0
+    truncated = False
+    queue = deque([source])
+    while queue and not truncated:
+        node = queue.popleft()
+        if node != source and stop_condition(node) or depth is not None and hops[node] >= depth:
+            continue
+        expanded.add(node)
+        next_hops = hops[node] + 1
+        for neighbor in adjacency[node]:
+            if neighbor in expanded:
+                # the edge was counted when the neighbor was expanded
+                continue
+            if max_edges is not None and edges >= max_edges or max_nodes is not None and neighbor not in hops and len(hops) >= max_nodes:
+                truncated = True
+                break
+            edges += 1
+            if neighbor not in hops:
+                hops[neighbor] = next_hops
+                queue.append(neighbor)
+    return hops, truncated
+
+
+def shortest_path(source: str, target: str, adjacency: Mapping[str, Iterable[str]], max_nodes: int = None) -> Tuple[Optional[List[str]], bool]:
+    # bidirectional breadth first search, the smaller frontier is expanded first; returns the path (None if there is
+    # none) and whether the search stopped after reaching max_nodes nodes
+    if source == target:
+        return [source], False
+    forward = {source: None}
+    backward = {target: None}
+    forward_frontier = [source]
+    backward_frontier = [target]
+    while forward_frontier and backward_frontier:
+        if len(forward_frontier) <= len(backward_frontier):
+            frontier, parents, others = forward_frontier, forward, backward
+        else:
+            frontier, parents, others = backward_frontier, backward, forward
+        next_frontier = []
+        for node in frontier:
+            for neighbor in adjacency[node]:
+                if neighbor in parents:
+                    continue
+                parents[neighbor] = node
+                if neighbor in others:
+                    path = []
+                    while neighbor is not None:
+                        path.append(neighbor)
+                        neighbor = forward[neighbor]
+                    path.reverse()
+                    neighbor = backward[path[-1]]
+                    while neighbor is not None:
+                        path.append(neighbor)
+                        neighbor = backward[neighbor]
+                    return path, False
+                if max_nodes is not None and len(forward) + len(backward) >= max_nodes:
+                    return None, True
+                next_frontier.append(neighbor)
+        if frontier is forward_frontier:
+            forward_frontier = next_frontier
+        else:
+            backward_frontier = next_frontier
+    return None, False
+
+
+class LRUCache():
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        # the nodes each entry was computed from, used to invalidate entries selectively
+        self.nodes = {}
+        self.lock = Lock()
+
+    def get(self, key: Hashable):
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def put(self, key: Hashable, value, nodes: Iterable[Hashable] = None):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            if nodes is not None:
+                self.nodes[key] = frozenset(nodes)
+            else:
+                self.nodes.pop(key, None)
+            while len(self.entries) > self.maxsize:
+                evicted, _ = self.entries.popitem(last=False)
+                self.nodes.pop(evicted, None)
+
+    def invalidate(self, nodes: Iterable[Hashable]):
+        # drops all entries computed from any of the given nodes, entries without nodes are dropped as well
+        nodes = set(nodes)
+        with self.lock:
+            stale = [key for key in self.entries if key not in self.nodes or not self.nodes[key].isdisjoint(nodes)]
+            for key in stale:
+                del self.entries[key]
+                self.nodes.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nodes.clear()
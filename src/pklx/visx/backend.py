@@ -1,37 +1,102 @@
-from flask import Flask, render_template, request
+from flask import Flask, g, render_template, request
 import networkx as nx
+import atexit
+import gc
 import json
+import os
+import signal
+import sys
+import time
+from contextlib import nullcontext
+from threading import RLock
+from typing import Dict, List, Optional
+from pklx import profiling
+from pklx.objects import PKLX
+from pklx.parser import compile_relations, list_files, load, load_file, statement_anchors, statement_prefixes, statements_to_graph, update_graph
+from pklx.search import SearchIndex
 from pklx.settings import SETTINGS
-from pklx.parser import load, statements_to_graph
-from pklx.utils import bfs
-import uuid
+from pklx.snapshot import load_snapshot
+from pklx.utils import LRUCache, bfs, breadth_first, shortest_path, undirected_adjacency
+from pklx.watch import FolderWatcher
 
 app = Flask(__name__)
 
 GRAPH = None
+# serialized list of all variable nodes, only built if it is requested
 NODES = None
-COLORS = {'variable': '#7a7a7a', 'relation': '#dd4b39'}
+ADJACENCY = None
+# variable nodes in insertion order
+VARIABLES = None
+# prefix and substring search over the variable nodes for /nodes?q=
+SEARCH = None
+# SQLite store that answers the requests instead of the graph in memory (pklx-view --store)
+STORE = None
+# largest page of search results
+MAX_LIMIT = 1000
+# default budgets of /related and /path so that hub variables can not stall the server and the browser
+MAX_NODES = 2000
+MAX_EDGES = 5000
+MAX_PATH_NODES = 100000
+# directions /related can follow the edges in
+DIRECTIONS = ('in', 'out', 'both')
+# the parsed statements of every file in load order and the ontology, only kept in watch mode
+FILES = None
+RELATIONS = None
+# whether the parse cache is used for reloads after the ontology changed
+USE_CACHE = True
+# guards the graph against concurrent updates by the watcher, without the watcher the graph is never changed and
+# requests run without locking
+LOCK = nullcontext()
+# serialized /related responses of the most recently requested nodes
+RESPONSES = LRUCache(maxsize=1024)
+COLORS = {'variable': '#7a7a7a', 'relation': '#dd4b39', 'source': '#00a303'}
 
 
-def format_graph(graph: nx.Graph) -> nx.Graph:
-    for node in graph.nodes:
-        graph.nodes[node]['id'] = str(uuid.uuid4())
-        if graph.nodes[node]['node_type'] != 'variable':
-            graph.nodes[node]['color'] = COLORS['relation']
-            graph.nodes[node]['label'] = " ".join(node.split()[1:])
+def format_graph(graph: nx.Graph, source: str = None) -> dict:
+    # node-link data for vis.js, built from copies so that the shared graph is never modified
+    nodes = []
+    for node, attributes in graph.nodes(data=True):
+        formatted_node = dict(attributes)
+        if attributes['node_type'] != 'variable':
+            formatted_node['color'] = COLORS['relation']
         else:
-            graph.nodes[node]['color'] = COLORS['variable']
-            graph.nodes[node]['label'] = node
-        graph.nodes[node]['shape'] = 'dot'
-        graph.nodes[node]['borderWidth'] = 0
-        graph.nodes[node]['size'] = 10
-    for source, destination in graph.edges:
-        graph[source][destination]['id'] = source + '-/-' + destination
-        graph[source][destination]['from'] = source
-        graph[source][destination]['to'] = destination
-        graph[source][destination]['width'] = 2
-        graph[source][destination]['color'] = COLORS['variable']
-    return graph
+            formatted_node['color'] = COLORS['variable']
+            formatted_node['label'] = node
+        if node == source:
+            formatted_node['color'] = COLORS['source']
+        formatted_node['shape'] = 'dot'
+        formatted_node['borderWidth'] = 0
+        formatted_node['size'] = 10
+        formatted_node['id'] = node
+        nodes.append(formatted_node)
+    links = []
+    for source_node, destination in graph.edges:
+        links.append({
+            'id': source_node + '-/-' + destination,
+            'from': source_node,
+            'to': destination,
+            'width': 2,
+            'color': COLORS['variable'],
+            'source': source_node,
+            'target': destination
+        })
+    return {'directed': True, 'multigraph': False, 'graph': {}, 'nodes': nodes, 'links': links}
+
+
+@app.before_request
+def start_request():
+    if profiling.PROFILER is not None:
+        g.start = time.perf_counter()
+
+
+@app.after_request
+def record_request(response):
+    profiler = profiling.PROFILER
+    if profiler is not None and 'start' in g:
+        name = g.get('profile_name', f'{request.method} {request.path}')
+        counts = g.get('profile_counts', {})
+        profiler.record('request', name, time.perf_counter() - g.start, bytes=response.content_length or 0, **counts)
+    return response
 
 
 @app.route('/')
@@ -40,32 +105,310 @@ def index():
 
 @app.route('/nodes', methods=['GET'])
 def nodes():
-    return NODES
+    global NODES
+    if request.args.get('all') in ('1', 'true'):
+        with LOCK:
+            if NODES is None:
+                NODES = json.dumps([{"id": node, "text": node} for node in (STORE.variable_nodes() if STORE is not None else VARIABLES)])
+            return NODES
+    if request.args.get('first') in ('1', 'true'):
+        # the node the viewer starts with, the first variable in load order
+        with LOCK:
+            first = next(iter(STORE.variable_nodes() if STORE is not None else VARIABLES), None)
+        return json.dumps({'results': [{"id": first, "text": first}] if first is not None else [], 'pagination': {'more': False}})
+    query = request.args.get('q', '')
+    limit = min(max(request.args.get('limit', 20, type=int), 0), MAX_LIMIT)
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    with LOCK:
+        names, more = SEARCH.search(query, limit, offset)
+    if profiling.PROFILER is not None:
+        g.profile_name = f'/nodes {query}'
+        g.profile_counts = {'results': len(names)}
+    # the format select2 expects from ajax requests
+    return json.dumps({'results': [{"id": name, "text": name} for name in names], 'pagination': {'more': more}})
+
+def request_error(data, nodes: List[str], counts: List[str]) -> Optional[str]:
+    # what is wrong with the body of a request, None if nothing is
+    if not isinstance(data, dict):
+        return 'The request body has to be a JSON object'
+    for key in nodes:
+        if not isinstance(data.get(key), str):
+            return f'{key} has to be the name of a node'
+    for key in counts:
+        value = data.get(key)
+        if value is not None and (type(value) != int or value < 0):
+            return f'{key} has to be a non-negative integer or null'
+    if data.get('direction', 'both') not in DIRECTIONS:
+        return f'Invalid direction: {data["direction"]}, use {", ".join(DIRECTIONS)}'
+    return None
+
+
+def error_response(status: int, message: str):
+    return json.dumps({'error': message}), status, {'Content-Type': 'application/json'}
+
 
 @app.route('/related', methods=['POST'])
 def related():
-    data = request.get_json()
+    # optional depth (hops), max_nodes, max_edges (null for no limit) and direction (in, out or both)
+    data = request.get_json(silent=True)
+    error = request_error(data, ['request'], ['depth', 'max_nodes', 'max_edges'])
+    if error is not None:
+        return error_response(400, error)
     node = data['request']
-    graph = bfs(GRAPH, node, stop_condition=lambda node: GRAPH.nodes[node]['node_type'] == 'variable')
-    graph = format_graph(graph)
-    graph.nodes[node]['color'] = '#00a303'
-    data = nx.json_graph.node_link_data(graph)
-    return json.dumps(data)
+    options = (data.get('depth'), data.get('max_nodes', MAX_NODES), data.get('max_edges', MAX_EDGES), data.get('direction', 'both'))
+    key = (node,) + options
+    response = RESPONSES.get(key)
+    if profiling.PROFILER is not None:
+        g.profile_name = f'/related {node}'
+        g.profile_counts = {'cached': int(response is not None)}
+    if response is None:
+        with LOCK, profiling.phase('related') as counts:
+            if node not in (STORE if STORE is not None else GRAPH):
+                return error_response(404, f'Unknown node: {node}')
+            depth, max_nodes, max_edges, direction = options
+            if STORE is not None:
+                adjacency = STORE.adjacency(direction)
+                hops, truncated = breadth_first(node, adjacency, lambda node: adjacency.node_types[node] == 'variable', depth, max_nodes, max_edges)
+                graph = STORE.subgraph(hops)
+            else:
+                graph, truncated = bfs(GRAPH, node, stop_condition=lambda node: GRAPH.nodes[node]['node_type'] == 'variable', adjacency=ADJACENCY,
+                                       depth=depth, max_nodes=max_nodes, max_edges=max_edges, direction=direction)
+            response = json.dumps(dict(format_graph(graph, node), truncated=truncated))
+            counts['nodes'] = graph.number_of_nodes()
+            # only the nodes the search expanded matter, changed edges of variables on the border do not change it
+            expanded = [related_node for related_node in graph.nodes if related_node == node or graph.nodes[related_node]['node_type'] != 'variable']
+            RESPONSES.put(key, response, expanded)
+    return response
+
+
+@app.route('/path', methods=['POST'])
+def path():
+    # shortest path between two nodes ignoring the edge directions, path is null if there is none
+    data = request.get_json(silent=True)
+    error = request_error(data, ['source', 'target'], ['max_nodes'])
+    if error is not None:
+        return error_response(400, error)
+    source = data['source']
+    target = data['target']
+    if profiling.PROFILER is not None:
+        g.profile_name = f'/path {source} {target}'
+    with LOCK, profiling.phase('path'):
+        for node in (source, target):
+            if node not in (STORE if STORE is not None else GRAPH):
+                return error_response(404, f'Unknown node: {node}')
+        adjacency = STORE.adjacency() if STORE is not None else ADJACENCY
+        nodes, truncated = shortest_path(source, target, adjacency, data.get('max_nodes', MAX_PATH_NODES))
+        graph = (STORE if STORE is not None else GRAPH).subgraph(nodes if nodes is not None else [])
+        return json.dumps(dict(format_graph(graph, source), path=nodes, truncated=truncated))
 
 
-def main():
+def set_graph(graph: nx.DiGraph, nodes: List[str] = None, adjacency: Dict[str, List[str]] = None):
     global GRAPH
     global NODES
-    relations, statements = load(SETTINGS['FOLDER_PATH'])
+    global ADJACENCY
+    global VARIABLES
+    global SEARCH
+    with LOCK:
+        if nodes is None:
+            nodes = [node for node in graph.nodes if graph.nodes[node]['node_type'] == 'variable']
+        GRAPH = graph
+        ADJACENCY = adjacency if adjacency is not None else undirected_adjacency(graph)
+        VARIABLES = dict.fromkeys(nodes)
+        SEARCH = SearchIndex(VARIABLES)
+        NODES = None
+        RESPONSES.clear()
+
+
+def files_to_statements(files: Dict[str, List[PKLX]]) -> List[PKLX]:
+    return [statement for statements in files.values() for statement in statements]
+
+
+def statements_to_files(statements: List[PKLX]) -> Dict[str, List[PKLX]]:
+    files = {}
+    for statement in statements:
+        files.setdefault(statement.source[0], []).append(statement)
+    return files
+
+
+def update(changed_files: List[str]):
+    global NODES
+    global FILES
+    global RELATIONS
+    folder_path = SETTINGS['FOLDER_PATH']
+    with LOCK:
+        if STORE is not None:
+            # the store finds the changed files itself
+            STORE.update()
+            NODES = None
+            RESPONSES.clear()
+            print(f'Updated {", ".join(os.path.relpath(file_name, folder_path) for file_name in changed_files)}')
+            return
+        if any(os.path.split(file_name)[-1] == '.ontology' for file_name in changed_files):
+            # the relations determine how every statement is parsed
+            RELATIONS, statements = load(folder_path, use_cache=USE_CACHE)
+            FILES = statements_to_files(statements)
+            set_graph(statements_to_graph(statements))
+            print(f'Ontology changed, reloaded {len(statements)} statements')
+            return
+
+        matcher = compile_relations(RELATIONS)
+        # new files get the next number, the numbers of the other files and so their node ids stay the same
+        files = GRAPH.graph['files']
+        old_statements = {}
+        new_statements = {}
+        added_files = False
+        for file_name in changed_files:
+            name = os.path.relpath(file_name, folder_path).replace(os.sep, '/')
+            try:
+                statements = load_file(file_name, name, None, matcher, SETTINGS['DELIMITER'])[2] if os.path.isfile(file_name) else []
+            except Exception as e:
+                # the previous version of the file stays in the graph until it can be parsed again
+                print(f'Could not update {name}: {e}')
+                continue
+            added_files = added_files or name not in FILES
+            if name not in files:
+                files[name] = len(files)
+            for i, statement in enumerate(FILES.get(name, [])):
+                old_statements[f'{files[name]}#{i}'] = statement
+            for i, statement in enumerate(statements):
+                new_statements[f'{files[name]}#{i}'] = statement
+            # changed files are replaced in place, they keep their load order
+            if statements:
+                FILES[name] = statements
+            else:
+                FILES.pop(name, None)
+            print(f'Updated {name}')
+        if added_files:
+            # files keep their load order, it decides which statement wins if a name is defined more than once
+            order = [os.path.relpath(file_name, folder_path).replace(os.sep, '/') for file_name in list_files(folder_path)]
+            FILES = {name: FILES[name] for name in order if name in FILES}
+
+        # statements in other files mentioning a named statement whose anchor moved have to be connected to the new anchor
+        statements = files_to_statements(FILES)
+        anchors = statement_anchors(statements, statement_prefixes(statements, files))
+        previous_anchors = GRAPH.graph['anchors']
+        moved = set(name for name in anchors.keys() | previous_anchors.keys() if anchors.get(name) != previous_anchors.get(name))
+        if moved:
+            for name, file_statements in FILES.items():
+                for i, statement in enumerate(file_statements):
+                    prefix = f'{files[name]}#{i}'
+                    if prefix not in new_statements and any(variable in moved for variable in statement.variables()):
+                        old_statements[prefix] = statement
+                        new_statements[prefix] = statement
+        affected = update_graph(GRAPH, old_statements, new_statements, anchors)
+
+        for node in affected:
+            if node in GRAPH:
+                ADJACENCY[node] = list(set(GRAPH.successors(node)).union(GRAPH.predecessors(node)))
+                if GRAPH.nodes[node]['node_type'] == 'variable':
+                    VARIABLES[node] = None
+                    SEARCH.add(node)
+            else:
+                ADJACENCY.pop(node, None)
+                VARIABLES.pop(node, None)
+                SEARCH.remove(node)
+        NODES = None
+        RESPONSES.invalidate(affected)
+
+
+def print_request(kind: str, name: str, seconds: float, counts: dict):
+    if kind == 'request':
+        print(f'{seconds * 1000:10.2f} ms  {name}', file=sys.stderr)
+
+
+def serve(host: str = '127.0.0.1', port: int = 5000, processes: int = 1):
+    # all processes accept connections on one socket and are forked after the graph was built, so that they share its
+    # memory copy-on-write; every process starts a thread per request
+    if processes <= 1 or not hasattr(os, 'fork'):
+        if processes > 1:
+            print('Forking is not available on this platform, serving with threads in one process')
+        app.run(host=host, port=port, threaded=True)
+        return
+    from werkzeug.serving import make_server
+    server = make_server(host, port, app, threaded=True)
+    # processes that lose the race for a connection return to waiting instead of blocking in accept
+    server.socket.setblocking(False)
+    # objects that exist now are never collected, so the garbage collector does not write to (and copy) shared pages
+    gc.collect()
+    gc.freeze()
+    children = []
+    for _ in range(processes):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                server.serve_forever()
+            finally:
+                os._exit(0)
+        children.append(pid)
+    print(f'Serving on http://{host}:{port} with {processes} processes')
+    # the workers stop with the main process, also when it is terminated
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        while children:
+            children.remove(os.wait()[0])
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+        for pid in children:
+            os.waitpid(pid, 0)
+        server.server_close()
+
+
+def main(workers: int = 1, watch: bool = False, interval: float = 1.0, profile: bool = False, processes: int = 1, host: str = '127.0.0.1', port: int = 5000,
+         use_store: bool = False, use_cache: bool = True, cache_stats: bool = False):
+    global FILES
+    global RELATIONS
+    global LOCK
+    global STORE
+    global SEARCH
+    global USE_CACHE
+    if watch and processes > 1:
+        raise Exception('The graph can only be watched for changes when it is served by one process')
+    profiler = profiling.enable() if profile else None
+    USE_CACHE = use_cache
+    stats = {}
+    # the watcher starts from the state before loading so that no change in between is missed
+    watcher = FolderWatcher(SETTINGS['FOLDER_PATH'], interval) if watch else None
+    if use_store:
+        # the graph stays in the database, the store also searches the variables
+        # sqlite3 is only imported if the store is used
+        from pklx.store import Store
+        STORE = SEARCH = Store(SETTINGS['FOLDER_PATH'])
+        STORE.update(workers=workers, rebuild=not use_cache, cache_stats=stats)
+        relations, statement_count = STORE.relations(), STORE.statement_count
+    else:
+        snapshot = load_snapshot(SETTINGS['FOLDER_PATH'], with_statements=watch, use_cache=use_cache, cache_stats=stats, workers=workers)
+        relations, statement_count = snapshot.relations, snapshot.statement_count
 
-    if not relations and not statements:
+    if not relations and not statement_count:
         print(f'No relations or statements found at {SETTINGS["FOLDER_PATH"]}. Please use pklx-set-settings FOLDER_PATH <absolute_path_to_data_folder> to set the path to the data folder.')
         exit(1)
 
-    GRAPH = statements_to_graph(statements)
-    node_names = [node for node in GRAPH.nodes if GRAPH.nodes[node]['node_type'] == 'variable']
-    NODES = json.dumps([{"id": node, "text": node} for node in node_names])
-    app.run()
+    if not use_store and snapshot.fresh:
+        print(f'Loaded {statement_count} statements from snapshot')
+    elif cache_stats and use_store:
+        print(f'Loaded {statement_count} statements (store: {stats["hits"]} unchanged, {stats["misses"]} parsed files)')
+    elif cache_stats and stats:
+        print(f'Loaded {statement_count} statements (cache: {stats["hits"]} hits, {stats["misses"]} misses)')
+    else:
+        print(f'Loaded {statement_count} statements')
+    if not use_store:
+        set_graph(snapshot.graph, snapshot.nodes, snapshot.adjacency)
+    if watcher is not None:
+        LOCK = RLock()
+        if not use_store:
+            RELATIONS = snapshot.relations
+            FILES = statements_to_files(snapshot.statements)
+        watcher.start(update)
+        print(f'Watching {SETTINGS["FOLDER_PATH"]} for changes')
+    if profiler is not None:
+        print(profiler.report(), file=sys.stderr)
+        # afterwards every request is printed and the slowest requests are reported on exit
+        profiler.subscribe(print_request)
+        atexit.register(lambda: print(profiler.report(), file=sys.stderr))
+    serve(host, port, processes)
 
 
 if __name__ == '__main__':
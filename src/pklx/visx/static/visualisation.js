@@ -5,6 +5,22 @@ var nodes, edges, network;
 var instructionText = 'Click on nodes to <b>find additional relations</b>. SHIFT+click to <b>collapse nodes</b>. The green node was the starting point.'
 var retrievalText = "Retrieving data. Please wait...";
 var noMoreDataText = "No more data found...";
+var truncatedText = "Too many relations, only some of them are shown...";
+var emptyText = "No variables found in the data folder.";
+
+// variables are searched on the server, one page of results at a time
+var pageSize = 50;
+var searchOptions = {
+    minimumInputLength: 1,
+    ajax: {
+        url: apiUri + "/nodes",
+        dataType: 'json',
+        delay: 100,
+        data: function (params) {
+            return { q: params.term, limit: pageSize, offset: ((params.page || 1) - 1) * pageSize };
+        }
+    }
+};
 
 var HttpClient = function() {
     this.get = function(url, aCallback) {
@@ -32,18 +48,22 @@ var HttpClient = function() {
 function start() {
     var client = new HttpClient();
     let names_box = $('#names_box');
-    client.get(apiUri + "/nodes", function(response) {
-          $("#names_box").select2({
-              data: response
-          });
-          names_box.val(response[0].id);
-          names_box.select2().trigger('change');
-          init(response[0].id);
+    client.get(apiUri + "/nodes?first=1", function(response) {
+          names_box.select2(searchOptions);
+          if (response.results.length == 0) {
+              // an empty data folder, the search still works once variables are added (pklx-view --watch)
+              draw();
+              document.getElementById('statement').innerHTML = emptyText;
+              return;
+          }
+          var first = response.results[0];
+          names_box.append(new Option(first.text, first.id, true, true)).trigger('change');
+          init(first.id);
     });
 }
 
-function instruction() {
-    document.getElementById('statement').innerHTML = noMoreDataText ;
+function instruction(text) {
+    document.getElementById('statement').innerHTML = text || noMoreDataText;
     setTimeout(function () { document.getElementById('statement').innerHTML = instructionText }, 1000);
 };
 
@@ -80,7 +100,7 @@ function getRelated(node) {
         }
         catch (err) { position = null };
         visualise(response.nodes, response.links, position);
-        instruction();
+        instruction(response.truncated ? truncatedText : noMoreDataText);
     });
 };
 
@@ -152,9 +172,7 @@ function draw() {
             init($('#names_box').val())
           });
 
-          $('#names_box').select2({
-            minimumInputLength: 1
-          });
+          $('#names_box').select2(searchOptions);
     });
     $(document).on('keydown', function (event) {
         if (event.shiftKey) {
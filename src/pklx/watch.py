@@ -0,0 +1,47 @@
+import os
+import time
+from threading import Thread
+from typing import Callable, Dict, List, Tuple
+from .parser import list_files
+
+
+class FolderWatcher():
+
+    def __init__(self, folder_path: str, interval: float = 1.0):
+        self.folder_path = folder_path
+        self.interval = interval
+        self.state = self.scan()
+
+    def scan(self) -> Dict[str, Tuple[int, int]]:
+        state = {}
+        for file_name in list_files(self.folder_path):
+            try:
+                stat = os.stat(file_name)
+            except FileNotFoundError:
+                continue
+            state[file_name] = (stat.st_mtime_ns, stat.st_size)
+        return state
+
+    def changes(self) -> List[str]:
+        # added, removed and modified files since the last call
+        state = self.scan()
+        changed = [file_name for file_name, stat in state.items() if self.state.get(file_name) != stat]
+        changed.extend(file_name for file_name in self.state if file_name not in state)
+        self.state = state
+        return changed
+
+    def run(self, callback: Callable[[List[str]], None]):
+        while True:
+            time.sleep(self.interval)
+            changed = self.changes()
+            if changed:
+                try:
+                    callback(changed)
+                except Exception as e:
+                    # a broken note must not stop the watcher, it is picked up again with its next change
+                    print(f'Could not update {", ".join(changed)}: {e}')
+
+    def start(self, callback: Callable[[List[str]], None]) -> Thread:
+        thread = Thread(target=self.run, args=(callback,), daemon=True)
+        thread.start()
+        return thread